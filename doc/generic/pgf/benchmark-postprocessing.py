@@ -0,0 +1,260 @@
+# Times the stages of postprocessing.py on synthetic pages of several sizes.
+# The baseline depends on the machine, so it is not part of the repository:
+# create it once with
+#     python3 benchmark-postprocessing.py --save-baseline
+# and after a change, compare with it using
+#     python3 benchmark-postprocessing.py --check
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+
+# postprocessing.py lives next to this script
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import postprocessing
+
+# size of the synthetic pages: number of entries in the sidetoc, subsections
+# (h5) per page, subsubsections (h6) per subsection, and code examples (each
+# with an image and an entryheadline) per subsubsection
+SCALES = {
+    "small": {"toc_entries": 30, "subsections": 3, "subsubsections": 2, "examples": 1},
+    "medium": {"toc_entries": 150, "subsections": 10, "subsubsections": 3, "examples": 2},
+    "large": {"toc_entries": 300, "subsections": 25, "subsubsections": 4, "examples": 3},
+}
+# every tenth sidetoc entry is a part, the others are its sections
+PART_EVERY = 10
+# stages faster than this are too noisy to be compared with the baseline
+MIN_SECONDS = 0.002
+
+parser = argparse.ArgumentParser(description="Benchmark postprocessing.py on synthetic lwarp pages")
+parser.add_argument("--scales", nargs="+", choices=SCALES, default=list(SCALES),
+                    help="page sizes to benchmark (default: all)")
+parser.add_argument("--repeat", type=int, default=5,
+                    help="number of timed runs per scale, the median is reported (default: 5)")
+parser.add_argument("--parser", choices=postprocessing.PARSERS, default="html5lib",
+                    help="tree builder used to parse the pages (default: html5lib)")
+parser.add_argument("--output", default="build-reports/benchmark.json",
+                    help="where to write the results (default: build-reports/benchmark.json)")
+parser.add_argument("--baseline", default="benchmark-baseline.json",
+                    help="baseline results to compare with (default: benchmark-baseline.json)")
+parser.add_argument("--save-baseline", action="store_true",
+                    help="store the results as the new baseline")
+parser.add_argument("--check", action="store_true",
+                    help="exit with an error if a stage is slower than the baseline by more than --tolerance")
+parser.add_argument("--tolerance", type=float, default=0.25,
+                    help="allowed slowdown relative to the baseline for --check (default: 0.25, i.e. 25%%)")
+args = parser.parse_args()
+
+def toc_entries(scale):
+    "(stem, class, section number, title) of every sidetoc entry"
+    entries = []
+    part = section = 0
+    for i in range(scale["toc_entries"]):
+        if i % PART_EVERY == 0:
+            part += 1
+            entries.append((f"part-{part}", "tocpart", str(part), f"Part {part}"))
+        else:
+            section += 1
+            entries.append((f"section-{section}", "tocsection", str(section), f"Section {section}"))
+    return entries
+
+def sidetoc(entries):
+    lines = ['<p><a href="index.html" class="linkhome">Home</a></p>']
+    for stem, cls, number, title in entries:
+        lines.append(f'<p><a href="{stem}.html#autosec-{stem}" class="{cls}">\n'
+                     f'<span class="sectionnumber">{number}</span>&#x2003;{title}</a></p>')
+    return "\n".join(lines)
+
+def page_body(stem, cls, number, title, scale, rng, destinations, images):
+    "the contents of section.textbody of a part page or a section page"
+    if cls == "tocpart":
+        return [f'<h2 id="autosec-{stem}">Part {number} {title}</h2>\n<p>Introduction to the part.</p>']
+    body = [f'<h4 id="autosec-{stem}"><span class="sectionnumber">{number}&#x2003;</span>{title}</h4>\n<a id="{stem}"></a>']
+    destinations[f"section.{number}"] = str(rng.randint(1, 1300))
+    for j in range(1, scale["subsections"] + 1):
+        destinations[f"subsection.{number}.{j}"] = str(rng.randint(1, 1300))
+        body.append(f'<h5 id="autosec-{stem}-{j}"><span class="sectionnumber">{number}.{j}&#x2003;</span>Subsection {j}</h5>\n'
+                    f'<a id="pgfmanual-auto-{stem}-{j}"></a>')
+        for k in range(1, scale["subsubsections"] + 1):
+            destinations[f"subsubsection.{number}.{j}.{k}"] = str(rng.randint(1, 1300))
+            body.append(f'<h6 id="autosec-{stem}-{j}-{k}"><span class="sectionnumber">{number}.{j}.{k}&#x2003;</span>Subsubsection {k}</h6>')
+            body.append('<p>Use <span class="texttt">\\draw</span><span class="texttt">[red]</span> or '
+                        '<span class="verb">\\fill</span>, see <a href="section-1.html#pgf.draw">draw</a>.</p>')
+            for e in range(scale["examples"]):
+                image = f"pgfmanual-images/{stem}-{j}-{k}-{e}"
+                images.append(image)
+                spaces = "&numsp;" * rng.randint(1, 40)
+                body.append(f'<div class="example"><div class="example-code"><p>\\begin{{tikzpicture}}<br>'
+                            f'{spaces}\\draw{"&numsp;" * 3}(0,0){{<a href="section-1.html#pgf.draw"> draw </a>}}&numsp;[x]'
+                            f'<span class="numsp">&numsp;</span><br>\\end{{tikzpicture}}</p></div>'
+                            f'<div class="example-image"><img src="{image}.svg" alt="" class="lateximage"></div></div>')
+                body.append(f'<div class="entryheadline"><p><a id="pgf./tikz/{stem}-{j}-{k}-{e}"></a>'
+                            f'<span class="texttt">/tikz/key {e}</span>=<span class="texttt">value</span></p></div>')
+                body.append(f'<p>Inline: <a href="{image}.svg"><img src="{image}.svg" class="inlineimage"></a></p>')
+    return body
+
+def page(title, toc, body):
+    return f'''<!DOCTYPE html>
+<html lang="en-US">
+<head>
+<meta charset="UTF-8">
+<title>{title}</title>
+<link rel="stylesheet" href="lwarp.css">
+<link rel="stylesheet" href="style.css">
+<script src="pgfmanual.js"></script>
+<script>
+// Lwarp MathJax emulation code
+window.MathJax = {{}};
+</script>
+<script id="MathJax-script" async src="https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-chtml.js"></script>
+</head>
+<body>
+<div data-nosnippet style="display:none">\\(\\newcommand{{\\pgf}}{{PGF}}\\)</div>
+<nav class="topnavigation"><a href="index.html">Home</a></nav>
+<div class="bodyandsidetoc">
+<div class="sidetoccontainer">
+<nav class="sidetoc">
+<div class="sidetoctitle"><p>Contents</p></div>
+<div class="sidetoccontents">
+{toc}
+</div>
+</nav>
+</div>
+<main class="bodycontainer">
+<section class="textbody">
+<h1>PGF/TikZ Manual</h1>
+{body}
+</section>
+</main>
+</div>
+<nav class="botnavigation"><a href="index.html">Home</a></nav>
+</body>
+</html>
+'''
+
+def generate_site(scale, seed=1):
+    """Write a part page and a section page of the given scale, with their images, into
+    the current directory. Returns the page filenames and the fake PDF destinations."""
+    rng = random.Random(seed)
+    entries = toc_entries(scale)
+    toc = sidetoc(entries)
+    destinations = {}
+    images = []
+    filenames = []
+    # the first part and its first section
+    for stem, cls, number, title in entries[:2]:
+        body = page_body(stem, cls, number, title, scale, rng, destinations, images)
+        with open(stem + ".html", "w") as f:
+            f.write(page(title, toc, "\n".join(body)))
+        filenames.append(stem + ".html")
+    os.makedirs("pgfmanual-images", exist_ok=True)
+    for image in images:
+        width = rng.randint(20, 400)
+        with open(image + ".svg", "w") as f:
+            f.write(f'<?xml version="1.0"?>\n<svg xmlns="http://www.w3.org/2000/svg" width="{width}pt" '
+                    f'height="{width // 2}pt" viewBox="0 0 {width} {width // 2}">'
+                    + '<path d="M0 0L1 1"/>' * rng.randint(1, 300) + '</svg>')
+        with open(image + ".png", "wb") as f:
+            f.write(rng.randbytes(rng.randint(100, 30000)))
+    return filenames, destinations
+
+def run_pages(filenames):
+    "process the pages once, returning the seconds of every stage, summed over the pages"
+    postprocessing.page_timings.clear()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for filename in filenames:
+            postprocessing.process_file(filename)
+            postprocessing.run_stage(filename, postprocessing.numspace_to_spaces, filename)
+    seconds = {}
+    for record in postprocessing.page_timings:
+        seconds[record["stage"]] = seconds.get(record["stage"], 0) + record["seconds"]
+    return seconds
+
+def benchmark_scale(name, scale):
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            filenames, destinations = generate_site(scale)
+            # _add_dimensions reads the (optimized) SVGs in processed/
+            shutil.copytree("pgfmanual-images", "processed/pgfmanual-images")
+            postprocessing.destinations = destinations
+            postprocessing.meta_descriptions = {}
+            postprocessing.chapter_tocs.clear()
+            with contextlib.redirect_stdout(io.StringIO()):
+                postprocessing.update_svg_dimensions(["processed/pgfmanual-images"])
+                postprocessing.build_image_format_table("pgfmanual-images")
+            # the first run builds the chapter toc model and warms up caches
+            run_pages(filenames)
+            runs = [run_pages(filenames) for _ in range(args.repeat)]
+        finally:
+            # also leave the temporary directory on errors, so that it can be removed
+            os.chdir(start_directory)
+    return {stage: statistics.median(run[stage] for run in runs) for stage in runs[0]}
+
+start_directory = os.getcwd()
+output = os.path.abspath(args.output)
+baseline_file = os.path.abspath(args.baseline)
+# time the stages without tracemalloc, whose bookkeeping would distort the results
+postprocessing.instrumentation_enabled = True
+postprocessing.html_parser = args.parser
+postprocessing.offline = True
+if args.check and not args.save_baseline and not os.path.isfile(baseline_file):
+    sys.exit(f"No baseline in {baseline_file}, run with --save-baseline first")
+
+results = {
+    "python": platform.python_version(),
+    "machine": platform.machine(),
+    "parser": args.parser,
+    "scales": {},
+}
+for name in args.scales:
+    print(f"Benchmarking {name} pages")
+    results["scales"][name] = benchmark_scale(name, SCALES[name])
+
+os.makedirs(os.path.dirname(output), exist_ok=True)
+with open(output, "w") as f:
+    json.dump(results, f, indent=1, sort_keys=True)
+print(f"Wrote {output}")
+
+baseline = None
+if os.path.isfile(baseline_file):
+    with open(baseline_file, "r") as f:
+        baseline = json.load(f)
+
+regressions = []
+for name, stages in results["scales"].items():
+    print(f"{name} (seconds for a part page and a section page)")
+    for stage, seconds in sorted(stages.items(), key=lambda item: -item[1]):
+        line = f"  {stage:<45} {seconds:8.4f} s"
+        base = baseline["scales"].get(name, {}).get(stage) if baseline else None
+        if base:
+            ratio = seconds / base
+            line += f"   baseline {base:8.4f} s   {ratio:5.2f}x"
+            if ratio > 1 + args.tolerance and seconds - base > MIN_SECONDS:
+                line += "   SLOWER"
+                regressions.append((name, stage, ratio))
+        print(line)
+
+if args.save_baseline:
+    with open(baseline_file, "w") as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    print(f"Saved baseline to {baseline_file}")
+
+if args.check:
+    if baseline is None:
+        sys.exit(f"No baseline in {baseline_file}, run with --save-baseline first")
+    if baseline["parser"] != args.parser:
+        print(f"Warning: the baseline was measured with {baseline['parser']}")
+    if regressions:
+        print(f"{len(regressions)} stages are more than {args.tolerance:.0%} slower than the baseline:")
+        for name, stage, ratio in regressions:
+            print(f"  {name}: {stage} ({ratio:.2f}x)")
+        sys.exit(1)
+    print("No regressions")
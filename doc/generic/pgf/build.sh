@@ -5,5 +5,4 @@ lwarpmk cleanall
 lwarpmk html
 ./build-limages-with-margin.lua limages
 sleep 5
-python3 postprocessing.py
-svgo -f processed/pgfmanual-images
\ No newline at end of file
+python3 postprocessing.py --jobs "$(nproc)"
@@ -1,7 +1,12 @@
+import argparse
+import hashlib
 import os
+import shutil
 import subprocess
 import time
 import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 DELETE_TOKEN = "\%\% PYTHON DELETE LINE\n"
 
@@ -73,7 +78,166 @@ END = r"""
 \end{document}
 """
 
+HEADERS = {
+    "HEADER": HEADER,
+    "SEAGULLHEADER": SEAGULLHEADER,
+    "PGFHEADER": PGFHEADER,
+}
+
+# compiled SVGs, stored under the hash of their standalone .tex file
+CACHE_DIRECTORY = ".build-cache/standalone"
+
+parser = argparse.ArgumentParser(description="Extract animation examples into standalone files and compile them to SVG")
+parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count(),
+                    help="number of standalones compiled in parallel (default: number of CPUs)")
+args = parser.parse_args()
+
+BEGIN_CODEEXAMPLE = "\\begin{codeexample}"
+END_CODEEXAMPLE = "\\end{codeexample}"
+
+class CodeExample(namedtuple("CodeExample", ["begin", "options_end", "end", "options", "code_start"])):
+    """A codeexample environment found by scan_codeexamples.
+
+    begin, options_end and end are line indices: the options end on line
+    options_end, and the code is lines[options_end+1:end], or, if the
+    environment ends on the line of the options, the text from column
+    code_start up to \\end{codeexample}. options maps each key to its value
+    (outer braces removed), or None for keys without value.
+    """
+
+    @property
+    def code_on_options_line(self):
+        return self.options_end == self.end
+
+    @property
+    def is_animation(self):
+        return "animation list" in self.options
+
+    @property
+    def has_precode(self):
+        return "pre" in self.options
+
+def split_top_level(text, separator):
+    "split text at separator, except inside braces"
+    parts = []
+    depth = 0
+    start = 0
+    for index, char in enumerate(text):
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(text[start:index])
+            start = index + 1
+    parts.append(text[start:])
+    return parts
+
+def parse_options(text):
+    "parse a key=value list the same way as the LPeg grammar in extract.lua"
+    options = {}
+    for item in split_top_level(text, ","):
+        key, has_value, value = item.partition("=")
+        key = key.strip()
+        if not key:
+            continue
+        value = value.strip()
+        if value.startswith("{") and value.endswith("}"):
+            value = value[1:-1]
+        options[key] = value if has_value else None
+    return options
+
+def read_options(lines, i, rest):
+    """Read the optional argument whose opening bracket starts rest, a suffix of lines[i].
+
+    Returns the text between the brackets, the index of the line with the
+    closing bracket and the remainder of that line, or None if the bracket is
+    never closed.
+    """
+    rest = rest.lstrip()[1:]
+    options_text = []
+    depth = 0
+    while True:
+        index = 0
+        while index < len(rest):
+            char = rest[index]
+            if char == "\\":
+                # skip escaped characters such as \{ and \%
+                index += 2
+                continue
+            if char == "%":
+                # comment until the end of the line
+                rest = rest[:index]
+                break
+            if char == "{":
+                depth += 1
+            elif char == "}":
+                depth -= 1
+            elif char == "]" and depth == 0:
+                options_text.append(rest[:index])
+                return "".join(options_text), i, rest[index + 1:]
+            index += 1
+        options_text.append(rest)
+        i += 1
+        if i == len(lines):
+            return None
+        rest = lines[i]
+
+def is_commented(line, column):
+    "whether an unescaped % comes before column on line"
+    index = 0
+    while index < column:
+        if line[index] == "\\":
+            index += 2
+            continue
+        if line[index] == "%":
+            return True
+        index += 1
+    return False
+
+def scan_codeexamples(lines, filename=""):
+    """Yield a CodeExample for every codeexample environment in lines.
+
+    Every line is looked at once, so this is linear in the length of the file,
+    except after an environment that is not closed, where the scan resumes on
+    the line after its \\begin.
+    """
+    i = 0
+    while i < len(lines):
+        column = lines[i].find(BEGIN_CODEEXAMPLE)
+        if column == -1 or is_commented(lines[i], column):
+            i += 1
+            continue
+        begin = i
+        rest = lines[i][column + len(BEGIN_CODEEXAMPLE):]
+        if not rest.strip() and i + 1 < len(lines) and lines[i + 1].lstrip().startswith("["):
+            # the optional argument starts on the next line
+            i += 1
+            rest = lines[i]
+        options_text = ""
+        if rest.lstrip().startswith("["):
+            result = read_options(lines, i, rest)
+            if result is None:
+                print(f"Warning: the options of the codeexample in {filename}:{begin + 1} are never closed")
+                i = begin + 1
+                continue
+            options_text, i, rest = result
+        options_end = i
+        # find \end{codeexample}, which may be on the same line as the options
+        if END_CODEEXAMPLE not in rest:
+            i += 1
+            while i < len(lines) and END_CODEEXAMPLE not in lines[i]:
+                i += 1
+            if i == len(lines):
+                print(f"Warning: the codeexample in {filename}:{begin + 1} has no \\end{{codeexample}}")
+                i = begin + 1
+                continue
+        code_start = len(lines[options_end]) - len(rest)
+        yield CodeExample(begin, options_end, i, parse_options(options_text), code_start)
+        i += 1
+
 images = []
+header_variants = {}
 
 # iterate through all .tex files in directory
 for filename in os.listdir('.'):
@@ -86,52 +250,48 @@ for filename in os.listdir('.'):
         # read file
         lines = f.readlines()
     made_changes = False
-    for i, line in enumerate(lines):
-        if "\\begin{codeexample}" in line:
-            is_animation = False
-            precode = False
-            codeexample_start = i
-            # find next line with \end{codeexample}
-            for j, line2 in enumerate(lines[i:]):
-                if "\\end{codeexample}" in line2:
-                    codeexample_end = j + i
-                    break
-            # find line with "]"
-            for j, line2 in enumerate(lines[i:]):
-                if "pre=" in line2:
-                    precode = True
-                if "animation list" in line2:
-                    is_animation = True
-                if "]" in line2:
-                    options_end = j + i
-                    break
-            if not is_animation:
-                continue
-            if precode:
-                print("Precode detected in " + filename)
-            # found animation codeblock
-            made_changes = True
-            image_filename = f"{base_filename}-animation-{image_no}"
-            lines[codeexample_start] = f"\\begin{{codeexample}}[imagesource={{standalone/{image_filename}.svg}}]\n"
-            for j in range(codeexample_start + 1, options_end + 1):
-                lines[j] = DELETE_TOKEN
-            example_code = lines[options_end + 1:codeexample_end]
-            lines[codeexample_end] = "\\end{codeexample}\n"
-            # write examplecode to file
-            with open("standalone/"+image_filename+".tex", 'w') as f:
-                if "pgfsys" in filename:
-                    f.write(PGFHEADER)
-                elif any("seagull" in line for line in example_code):
-                    f.write(SEAGULLHEADER)
-                else:
-                    f.write(HEADER)
-                if example_code[-1] == '\n':
-                    example_code = example_code[:-1]
-                for line in example_code:
-                    f.write(line)
-                f.write(END)
-            images.append(image_filename)
-            image_no += 1
+    for example in scan_codeexamples(lines, filename):
+        if not example.is_animation:
+            continue
+        if example.has_precode:
+            print("Precode detected in " + filename)
+        # found animation codeblock
+        made_changes = True
+        image_filename = f"{base_filename}-animation-{image_no}"
+        begin_line = f"\\begin{{codeexample}}[imagesource={{standalone/{image_filename}.svg}}]"
+        end_line = "\\end{codeexample}\n"
+        if example.code_on_options_line:
+            line = lines[example.end]
+            code = line[example.code_start:line.index(END_CODEEXAMPLE, example.code_start)].strip()
+            example_code = [code + "\n"]
+            end_line = code + end_line
+        else:
+            example_code = lines[example.options_end + 1:example.end]
+        for j in range(example.begin + 1, example.options_end + 1):
+            lines[j] = DELETE_TOKEN
+        if example.begin == example.end:
+            # a one-line example: both edits go into the same line
+            lines[example.begin] = begin_line + end_line
+        else:
+            lines[example.begin] = begin_line + "\n"
+            lines[example.end] = end_line
+        # write examplecode to file
+        if "pgfsys" in filename:
+            header_variant = "PGFHEADER"
+        elif any("seagull" in line for line in example_code):
+            header_variant = "SEAGULLHEADER"
+        else:
+            header_variant = "HEADER"
+        with open("standalone/"+image_filename+".tex", 'w') as f:
+            f.write(HEADERS[header_variant])
+            if example_code and example_code[-1] == '\n':
+                example_code = example_code[:-1]
+            for line in example_code:
+                f.write(line)
+            f.write(END)
+        images.append(image_filename)
+        header_variants[image_filename] = header_variant
+        image_no += 1
     if made_changes:
         print("Made changes to", filename)
         with open("standalone/"+filename, 'w') as f:
@@ -139,8 +299,50 @@ for filename in os.listdir('.'):
                 if line != DELETE_TOKEN:
                     f.write(line)
 
+def cache_key(image):
+    "hash of the standalone .tex file together with its header variant"
+    with open("standalone/"+image+".tex", 'rb') as f:
+        key = hashlib.sha256(f.read())
+    key.update(header_variants.get(image, "").encode())
+    return key.hexdigest()
+
+def compile_standalone(image):
+    "compile one standalone to SVG, returning (status, error message)"
+    if not os.path.isfile("standalone/"+image+".tex"):
+        return "failed", "standalone/"+image+".tex does not exist"
+    cached_svg = os.path.join(CACHE_DIRECTORY, cache_key(image) + ".svg")
+    if os.path.isfile(cached_svg):
+        # copy2 keeps the modification time of the cache entry, so the SVG looks unchanged to the postprocessing
+        shutil.copy2(cached_svg, "standalone/"+image+".svg")
+        return "cached", None
+    # separate output directory per image so that parallel runs don't share aux files
+    output_directory = "standalone/dvi/"+image
+    os.makedirs(output_directory, exist_ok=True)
+    lualatex = subprocess.run(["lualatex", "--output-format=dvi", "-interaction=batchmode", "-output-directory", output_directory, "standalone/"+image+".tex"], capture_output=True)
+    if lualatex.returncode != 0:
+        return "failed", f"lualatex exited with code {lualatex.returncode}, see {output_directory}/{image}.log"
+    dvisvgm = subprocess.run(["dvisvgm", output_directory+"/"+image+".dvi", "-o", "standalone/"+image+".svg"], capture_output=True)
+    if dvisvgm.returncode != 0:
+        return "failed", f"dvisvgm exited with code {dvisvgm.returncode}: {dvisvgm.stderr.decode().strip()}"
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    # identical standalones may finish at the same time, so write the cache entry atomically
+    shutil.copy2("standalone/"+image+".svg", cached_svg+"."+image)
+    os.replace(cached_svg+"."+image, cached_svg)
+    return "compiled", None
+
 print("Compiling")
-images.append("pgfmanual-en-tikz-pics-animation-1")
-for image in images:
-    subprocess.run(["lualatex", "--output-format=dvi", "-interaction=batchmode", "-output-directory", "standalone/dvi", "standalone/"+image+".tex"])
-    subprocess.run(["dvisvgm", "standalone/dvi/"+image+".dvi", "-o", "standalone/"+image+".svg"])
\ No newline at end of file
+if "pgfmanual-en-tikz-pics-animation-1" not in images:
+    images.append("pgfmanual-en-tikz-pics-animation-1")
+images.sort()
+failures = []
+with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+    for image, (status, error) in zip(images, executor.map(compile_standalone, images)):
+        print(f"{status.capitalize()} {image}")
+        if status == "failed":
+            failures.append((image, error))
+
+if failures:
+    print(f"{len(failures)} of {len(images)} standalones failed to compile:")
+    for image, error in failures:
+        print(f"  {image}: {error}")
+    sys.exit(1)
@@ -1,77 +1,136 @@
-from unicodedata import name
-from xml.dom import minidom
-from bs4 import BeautifulSoup, Comment, NavigableString
-from shutil import copyfile, copytree
+from xml.etree import ElementTree
+from bs4 import BeautifulSoup, Comment, NavigableString, Tag
+from bs4.formatter import HTMLFormatter
+from shutil import copy2, copyfile
+import argparse
+import contextlib
+import copy
+import cProfile
+import csv
+import hashlib
+import io
 import json
+import math
+import multiprocessing
 import re
 import os
 import sys
 import datetime
+import fcntl
+import gzip
+import difflib
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import subprocess
-import requests
-
-def kilobytes(filename):
-    st = os.stat(filename)
-    return st.st_size / 1000
-
-# mkdir processed
-os.makedirs("processed", exist_ok=True)
-copyfile("style.css", "processed/style.css")
-copyfile("lwarp.css", "processed/lwarp.css")
-copyfile("pgfmanual.js", "processed/pgfmanual.js")
-copyfile("lwarp-mathjax-emulation.js", "processed/lwarp-mathjax-emulation.js")
-copytree("pgfmanual-images", "processed/pgfmanual-images", dirs_exist_ok=True)
-copytree("standalone", "processed/standalone", dirs_exist_ok=True)
-copytree("banners/social-media-banners", "processed/social-media-banners", dirs_exist_ok=True)
-copytree("banners/toc-banners", "processed/toc-banners", dirs_exist_ok=True)
-
-# get PDF version, and get the page numbers of all the sections
-# (this will be used in the deep links)
-pdf_url = "https://pgf-tikz.github.io/pgf/pgfmanual.pdf"
-if not os.path.isfile("pgfmanual.pdf"):
-    print("Downloading PDF")
-    response = requests.get(pdf_url)
-    with open("pgfmanual.pdf", "wb") as file:
-        file.write(response.content)
-# run "pdfinfo -dests pgfmanual.pdf", get the stdout
-print("Getting PDF page numbers")
-pdfinfo = subprocess.run(["pdfinfo", "-dests", "pgfmanual.pdf"], capture_output=True)
-destinations = {}
-# example line:
-# 1268 [ XYZ   64  102 null      ] "subsection.123.10"
-# should become
-# destinations["subsection.123.10"] = "1268"
-if pdfinfo.returncode == 0:
-    output = pdfinfo.stdout.decode()
-    lines = output.split('\n')
-    for line in lines:
-        match = re.search(r'(\d+) \[ XYZ\s+\d+\s+\d+\s+null\s+\] "(.+?)"', line)
-        if match:
-            page_number = match.group(1)
-            destination_name = match.group(2)
-            destinations[destination_name] = page_number
-else:
-    print("Error running pdfinfo:", pdfinfo.stderr.decode())
+import tempfile
+import time
+import tracemalloc
+# requests is imported by the functions that access the network, so that importing
+# this module (in worker processes, the benchmark or tests) stays cheap
 
-meta_descriptions = json.load(open("meta-descriptions.json"))
+# destinations and meta_descriptions are loaded on first use, see get_destinations
+destinations = None
+meta_descriptions = None
+svg_dimensions = {}
+image_formats = {}
+commit_date = None
 
 def add_version_date(soup):
     "For the home page, add the date of the last commit to the pgf repository"
     "do this because otherwise Google could interpret the version number"
     "as a date (e.g. 3.1.10 -> 2010-03-01), which looks bad"
-    url = f"https://api.github.com/repos/pgf-tikz/pgf/commits"
-    response = requests.get(url, params={"per_page": 1})
-    if response.status_code == 200:
-        commit_data = response.json()[0]
-        commit_date = commit_data['commit']['author']['date']
-        commit_date = datetime.date.fromisoformat(commit_date.split("T")[0])
-        manual_version = soup.find(class_="manual-version")
-        manual_version.insert(0, f"Updated {commit_date.strftime('%Y-%m-%d')} – ")
-    else:
-        raise Exception(f"Error fetching last commit date: {response.status_code}")
+    if commit_date is None:
+        return
+    manual_version = soup.find(class_="manual-version")
+    manual_version.insert(0, f"Updated {commit_date} – ")
+
+## commit date
+# the date of the last commit to the pgf repository (as YYYY-MM-DD) is
+# determined once at startup, so that processing the home page never waits for
+# the network. The providers are tried in order; the GitHub API is only asked
+# if none of them knows the date, and the request runs while the other
+# startup work is done.
+COMMIT_DATE_FILE = ".build-cache/commit-date.json"
+COMMIT_DATE_TTL = 6 * 60 * 60 # seconds
+COMMIT_DATE_TIMEOUT = 10 # seconds
+COMMIT_DATE_URL = "https://api.github.com/repos/pgf-tikz/pgf/commits"
+
+def commit_date_from_environment():
+    "PGF_COMMIT_DATE=2023-01-15 sets the date directly (e.g. for tests)"
+    return os.environ.get("PGF_COMMIT_DATE")
+
+def commit_date_from_git():
+    "PGF_REPOSITORY=path/to/pgf uses the last commit of a local checkout"
+    repository = os.environ.get("PGF_REPOSITORY")
+    if not repository:
+        return None
+    result = subprocess.run(["git", "-C", repository, "log", "-1", "--format=%aI"], capture_output=True)
+    if result.returncode != 0:
+        print("Error reading commit date from " + repository + ":", result.stderr.decode().strip())
+        return None
+    return result.stdout.decode().strip().split("T")[0]
+
+def read_commit_date_cache():
+    if os.path.isfile(COMMIT_DATE_FILE):
+        with open(COMMIT_DATE_FILE, "r") as f:
+            return json.load(f)
+    return None
+
+def commit_date_from_cache():
+    "the date fetched from GitHub by a recent run"
+    cache = read_commit_date_cache()
+    if cache is not None and time.time() - cache["fetched"] < COMMIT_DATE_TTL:
+        return cache["date"]
+    return None
+
+COMMIT_DATE_PROVIDERS = [commit_date_from_environment, commit_date_from_git, commit_date_from_cache]
+
+def fetch_commit_date():
+    "ask the GitHub API, raising an exception if this fails"
+    import requests
+    response = requests.get(COMMIT_DATE_URL, params={"per_page": 1}, timeout=COMMIT_DATE_TIMEOUT)
+    if response.status_code != 200:
+        raise Exception(f"status {response.status_code}")
+    date = response.json()[0]['commit']['author']['date'].split("T")[0]
+    os.makedirs(os.path.dirname(COMMIT_DATE_FILE), exist_ok=True)
+    with open(COMMIT_DATE_FILE, "w") as f:
+        json.dump({"date": date, "fetched": time.time()}, f)
+    return date
+
+def start_commit_date_lookup(executor):
+    "returns a function that gives the commit date, which may be running in the background until then"
+    for provider in COMMIT_DATE_PROVIDERS:
+        date = provider()
+        if date is not None:
+            return lambda: date
+    if offline:
+        return stale_commit_date
+    future = executor.submit(fetch_commit_date)
+    def result():
+        # errors are printed here rather than in the background thread, so they don't interrupt other output
+        try:
+            date = future.result(timeout=COMMIT_DATE_TIMEOUT)
+        except FutureTimeoutError:
+            print("Timed out fetching last commit date")
+            date = None
+        except Exception as error:
+            print(f"Error fetching last commit date: {error}")
+            date = None
+        return date if date is not None else stale_commit_date()
+    return result
+
+def stale_commit_date():
+    "the last date fetched from GitHub, however old, or None"
+    cache = read_commit_date_cache()
+    if cache is None:
+        print("Last commit date unknown, not adding it to the home page")
+        return None
+    return cache["date"]
 
 ## table of contents and anchor links
 def rearrange_heading_anchors(soup):
+    destinations = get_destinations()
     heading_tags = ["h4", "h5", "h6"]
     for tag in soup.find_all(heading_tags):
         entry = tag.find()
@@ -124,7 +183,7 @@ def rearrange_heading_anchors(soup):
             else:
                 break
 
-def add_copyright_comment_block(filename, soup):
+def read_copyright_lines(filename):
     # open tex file to fetch copyright block (initial lines starting in %)
     stem = os.path.splitext(filename)[0]
     tex_filename = f"pgfmanual-en-{stem}.tex"
@@ -136,6 +195,10 @@ def add_copyright_comment_block(filename, soup):
                     copyright_lines.append(line[1:].strip())
                 else:
                     break
+    return copyright_lines
+
+def add_copyright_comment_block(filename, soup):
+    copyright_lines = read_copyright_lines(filename)
     if not copyright_lines:
         copyright_lines = [
             "Copyright 2019 by Till Tantau",
@@ -200,7 +263,7 @@ def add_class(tag, c):
     else:
         tag['class'] = [c]
 
-def _add_mobile_toc(soup):
+def _add_mobile_toc(soup, sections):
     "on part overview pages, add a list of sections for mobile users"
     mobile_toc = soup.new_tag('div')
     mobile_toc['class'] = 'mobile-toc'
@@ -209,13 +272,10 @@ def _add_mobile_toc(soup):
     mobile_toc.append(mobile_toc_title)
     mobile_toc_list = soup.new_tag('ul')
     mobile_toc.append(mobile_toc_list)
-    # get toc contents
-    toc_container = soup.find(class_="sidetoccontainer")
-    toc_items = toc_container.find_all('a', class_="tocsection")
-    for item in toc_items:
+    for section in sections:
         li = soup.new_tag('li')
-        a = soup.new_tag('a', href=item.get('href'))
-        a.string = item.text
+        a = soup.new_tag('a', href=section["href"])
+        a.string = section["title"]
         li.append(a)
         mobile_toc_list.append(li)
     # add toc to section class="textbody", after the h2
@@ -248,20 +308,25 @@ def make_breadcrumb(soup, breadcrumb):
 
 
 ## shorten sidetoc
-def shorten_sidetoc_and_add_part_header(soup, is_home=False):
-    container = soup.find(class_="sidetoccontainer")
-    container['id'] = "chapter-toc-container"
-    sidetoc = soup.find(class_="sidetoccontents")
-    if soup.h4 is None:
-        my_file_id = soup.h2['id']    
-        is_a_section = False
-    else:
-        my_file_id = soup.h4['id']
-        is_a_section = True
-    toc = []
+# lwarp writes the same sidetoc, listing all parts and sections of the manual,
+# into every page. Its entries are cleaned up once (per parser), and every page
+# then copies the entries it shows: all parts, and the sections of its own part.
+chapter_tocs = {}
+
+def read_chapter_toc(soup, sidetoc):
+    """Clean up the entries of the sidetoc and return the chapter toc model.
+
+    The model is a list of nodes, one for every child of the sidetoc, in order.
+    Each node has the cleaned-up child ("tag"), its "kind" (None, "intro", "part"
+    or "section"), and for parts and sections the "file_id", "title" and "href"
+    of the entry; sections also have the node of their "part" (None if the
+    section comes before the first part).
+    """
+    nodes = []
     last_part = None
-    my_part = None
-    for entry in sidetoc.children:
+    for entry in list(sidetoc.children):
+        node = {"tag": entry, "kind": None}
+        nodes.append(node)
         if entry.name != 'p':
             continue
         # Skip home link
@@ -287,64 +352,85 @@ def shorten_sidetoc_and_add_part_header(soup, is_home=False):
         # Skip introduction link because it doesn't have a part
         if entry.a['href'] == "index-0":
             entry.a['class'] = ['linkintro']
-            if is_home:
-                entry['class'] = ['current']
+            node["kind"] = "intro"
             continue
+        node.update(file_id=file_id, title=entry.a.get_text(), href=entry.a.get('href'))
         if "tocpart" in entry.a['class']:
-            element = {
-                "tag": entry,
-                "file_id": file_id,
-                "children": []
-            }
-            last_part = element
-            toc.append(element)
-            if file_id == my_file_id:
-                assert 'class' not in entry
-                entry['class'] = ["current"]
-                soup.title.string = entry.a.get_text() + " - PGF/TikZ Manual"
-                my_part = element
+            node["kind"] = "part"
+            last_part = node
         elif "tocsection" in entry.a['class']:
-            element = {
-                "tag": entry,
-                "file_id": file_id,
-            }
-            if last_part:
-                last_part['children'].append(element)
-            if file_id == my_file_id:
-                assert 'class' not in entry
-                entry['class'] = ["current"]
-                my_part = last_part
-                my_title = entry.a.get_text()
-                my_href = entry.a.get('href')
-                soup.title.string = my_title + " - PGF/TikZ Manual"
+            node["kind"] = "section"
+            node["part"] = last_part
         else:
             print(f"unknown class: {entry.a['class']}")
-    for part in toc:
-        if part != my_part:
-            for section in part['children']:
-                section['tag'].decompose()
-        else:
-            add_class(part['tag'], "current-part")
-            for section in part['children']:
-                add_class(section['tag'], "current-part")
-            if is_a_section:
-                h2 = soup.new_tag('h2')
-                h2['class'] = ['inserted']
-                # contents = part['tag'].a.contents[1:]
-                # h2.append(contents[1].replace("\u2003", ""))
-                part_name = part['tag'].a.get_text()
-                assert part_name is not None
-                h2.append(part_name)
-                soup.h1.insert_after(h2)
-                breadcrumb = [
-                    {"name": part_name, "item": "https://tikz.dev/" + part['tag'].a.get('href')},
-                    {"name": my_title, "item": "https://tikz.dev/" + my_href}
-                ]
-                make_breadcrumb(soup, breadcrumb)
+    return nodes
+
+def _copy_toc_node(node):
+    "copy a node of the chapter toc model, including the class lists"
+    node = copy.copy(node)
+    if isinstance(node, Tag):
+        for tag in [node] + node.find_all(True):
+            for key, value in tag.attrs.items():
+                if isinstance(value, list):
+                    tag[key] = list(value)
+    return node
+
+def shorten_sidetoc_and_add_part_header(soup, is_home=False):
+    container = soup.find(class_="sidetoccontainer")
+    container['id'] = "chapter-toc-container"
+    sidetoc = soup.find(class_="sidetoccontents")
+    if soup.builder.NAME not in chapter_tocs:
+        chapter_tocs[soup.builder.NAME] = read_chapter_toc(soup, sidetoc)
+    chapter_toc = chapter_tocs[soup.builder.NAME]
+    if soup.h4 is None:
+        my_file_id = soup.h2['id']    
+        is_a_section = False
+    else:
+        my_file_id = soup.h4['id']
+        is_a_section = True
+    my_part = None
+    my_section = None
+    for node in chapter_toc:
+        if node["kind"] in ["part", "section"] and node["file_id"] == my_file_id:
+            if node["kind"] == "part":
+                my_part = node
+            else:
+                my_part = node["part"]
+                my_section = node
+            soup.title.string = node["title"] + " - PGF/TikZ Manual"
+    # only keep the sections of the current part
+    sidetoc.clear()
+    sections = []
+    for node in chapter_toc:
+        if node["kind"] == "section" and node["part"] is not None and node["part"] is not my_part:
+            continue
+        entry = _copy_toc_node(node["tag"])
+        if node["kind"] == "intro" and is_home:
+            entry['class'] = ['current']
+        elif node["kind"] in ["part", "section"]:
+            if node["file_id"] == my_file_id:
+                entry['class'] = ["current"]
+            if node is my_part or (node["kind"] == "section" and node["part"] is not None):
+                add_class(entry, "current-part")
+            if node["kind"] == "section":
+                sections.append(node)
+        sidetoc.append(entry)
+    if is_a_section and my_part is not None:
+        h2 = soup.new_tag('h2')
+        h2['class'] = ['inserted']
+        part_name = my_part["title"]
+        assert part_name is not None
+        h2.append(part_name)
+        soup.h1.insert_after(h2)
+        breadcrumb = [
+            {"name": part_name, "item": "https://tikz.dev/" + my_part["href"]},
+            {"name": my_section["title"], "item": "https://tikz.dev/" + my_section["href"]}
+        ]
+        make_breadcrumb(soup, breadcrumb)
     if not is_a_section and not is_home:
         # this is a part overview page
         # let's insert an additional local table of contents for mobile users
-        _add_mobile_toc(soup)
+        _add_mobile_toc(soup, sections)
 
 ## make anchor tags to definitions
 def get_entryheadline_p(tag):
@@ -380,23 +466,79 @@ def make_entryheadline_anchor_links(soup):
         p_tag.append(link)
 
 ## write to file
-def write_to_file(soup, filename):
-    with open(filename, "w") as file:
-        html = soup.encode(formatter="html5").decode("utf-8")
-        html = html.replace("index-0","/")
-        lines = html.splitlines()
-        new_lines = []
+# elements up to this depth are serialized tag by tag, deeper ones in one piece
+# (depth 5 are the paragraphs, figures, headings... inside section.textbody)
+SERIALIZE_SPLIT_DEPTH = 5
+html5_formatter = HTMLFormatter.REGISTRY["html5"]
+line_boundary_pattern = re.compile("[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]")
+leading_whitespace_pattern = re.compile(r"^\s*")
+multiple_spaces_pattern = re.compile(' +')
+
+def _serialize_pieces(node, depth=0):
+    "yield the html5 serialization of node in pieces, so the whole page is never one string"
+    if isinstance(node, BeautifulSoup):
+        for child in node.contents:
+            yield from _serialize_pieces(child, depth)
+    elif not isinstance(node, Tag):
+        yield node.output_ready(formatter=html5_formatter)
+    elif depth >= SERIALIZE_SPLIT_DEPTH or not node.contents:
+        yield node.decode(formatter=html5_formatter)
+    else:
+        # serialize an empty copy of the tag to get its opening and closing tags
+        empty = Tag(name=node.name, namespace=node.namespace, prefix=node.prefix, attrs=node.attrs,
+                    can_be_empty_element=node.can_be_empty_element)
+        html = empty.decode(formatter=html5_formatter)
+        closing = "</" + (node.prefix + ":" if node.prefix else "") + node.name + ">"
+        assert html.endswith(closing)
+        yield html[:-len(closing)]
+        for child in node.contents:
+            yield from _serialize_pieces(child, depth + 1)
+        yield closing
+
+def _normalize_line(line):
+    line = line.replace("index-0","/")
+    # count number of spaces at the start of line
+    spaces_at_start = len(leading_whitespace_pattern.match(line).group(0))
+    line = line.strip()
+    # replace multiple spaces by a single space
+    line = multiple_spaces_pattern.sub(' ', line)
+    # restore indentation
+    return " " * spaces_at_start + line
+
+def serialized_lines(soup):
+    "yield the normalized lines of the page while it is being serialized"
+    pending = []
+    for piece in _serialize_pieces(soup):
+        pending.append(piece)
+        if not line_boundary_pattern.search(piece):
+            continue
+        lines = "".join(pending).splitlines(keepends=True)
+        pending = []
+        last = lines[-1]
+        if last.endswith("\r") or last.splitlines()[0] == last:
+            # the last line may continue in the next piece (a \r may be followed by \n)
+            pending.append(lines.pop())
         for line in lines:
-            # count number of spaces at the start of line
-            spaces_at_start = len(re.match(r"^\s*", line).group(0))
-            line = line.strip()
-            # replace multiple spaces by a single space
-            line = re.sub(' +', ' ', line)
-            # restore indentation
-            line = " " * spaces_at_start + line
-            new_lines.append(line)
-        html = "\n".join(new_lines)
-        file.write(html)
+            yield _normalize_line(line.splitlines()[0])
+    for line in "".join(pending).splitlines():
+        yield _normalize_line(line)
+
+def serialize_page(soup):
+    return "\n".join(serialized_lines(soup))
+
+def write_to_file(soup, filename, patches=()):
+    """Serialize soup into filename, applying the string patches to the page on the way.
+
+    The patches never match across a line break, so applying them line by line
+    gives the same result as applying them to the whole page.
+    """
+    with open(filename, "w") as file:
+        for index, line in enumerate(serialized_lines(soup)):
+            if index > 0:
+                file.write("\n")
+            for patch in patches:
+                line = patch(line)
+            file.write(line)
 
 def remove_mathjax_if_possible(filename, soup):
     with open(filename, "r") as file:
@@ -424,27 +566,25 @@ def remove_mathjax_if_possible(filename, soup):
                     mathjax_script_tag.insert_before(script)
                     break
 
-def remove_html_from_links(filename, soup):
-    for tag in soup.find_all("a"):
-        if 'href' in tag.attrs:
-            if tag['href'] == "index.html" or tag['href'] == "index":
-                tag['href'] = "/"
-            tag['href'] = tag['href'].replace('.html', '')
-            if filename == "index.html":
-                if "#" in tag['href']:
-                    tag['href'] = tag['href'].split('#')[0]
+def remove_html_from_links(page, tag):
+    if 'href' in tag.attrs:
+        if tag['href'] == "index.html" or tag['href'] == "index":
+            tag['href'] = "/"
+        tag['href'] = tag['href'].replace('.html', '')
+        if page["filename"] == "index.html":
+            if "#" in tag['href']:
+                tag['href'] = tag['href'].split('#')[0]
 
 def remove_useless_elements(soup):
     # soup.find("h1").decompose()
     soup.find(class_="topnavigation").decompose()
     soup.find(class_="botnavigation").decompose()
 
-def addClipboardButtons(soup):
-    for example in soup.find_all(class_="example-code"):
-        button = soup.new_tag('button', type="button")
-        button['class'] = "clipboardButton"
-        button.string = "copy"
-        example.insert(0,button)
+def addClipboardButtons(page, example):
+    button = page["soup"].new_tag('button', type="button")
+    button['class'] = "clipboardButton"
+    button.string = "copy"
+    example.insert(0,button)
 
 def add_header(soup):
     header = soup.new_tag('header')
@@ -562,89 +702,204 @@ def add_footer(soup):
     footer.append(footer_right)
     soup.find(class_="bodyandsidetoc").append(footer)
 
+## SVG dimensions
+# width and height of every SVG in processed/ (which are the optimized files),
+# keyed by path and persisted between builds, so that each file is only read
+# again when its mtime or size changes
+SVG_DIMENSIONS_FILE = ".build-cache/svg-dimensions.json"
+# lengths in pt; lengths without unit are in px
+SVG_UNITS = {"pt": 1, "px": 0.75, "pc": 12, "in": 72, "cm": 72 / 2.54, "mm": 72 / 25.4}
+
+def _length_in_pt(length):
+    "convert an SVG length such as 12pt, 16px or 16 (svgo converts pt to px where it is shorter)"
+    for unit, factor in SVG_UNITS.items():
+        if length.endswith(unit):
+            return float(length[:-len(unit)]) * factor
+    try:
+        return float(length) * SVG_UNITS["px"]
+    except ValueError:
+        return None
+
+def read_svg_dimensions(svgfilename):
+    "read width and height (in pt) from the root element, without parsing the rest of the file"
+    with open(svgfilename, "rb") as svgfile:
+        for event, element in ElementTree.iterparse(svgfile, events=("start",)):
+            return _length_in_pt(element.get("width", "")), _length_in_pt(element.get("height", ""))
+
+def get_svg_dimensions(svgfilename):
+    st = os.stat(svgfilename)
+    entry = svg_dimensions.get(svgfilename)
+    if entry is None or entry["mtime"] != st.st_mtime_ns or entry["size"] != st.st_size:
+        width_pt, height_pt = read_svg_dimensions(svgfilename)
+        entry = {"mtime": st.st_mtime_ns, "size": st.st_size, "width": width_pt, "height": height_pt}
+        svg_dimensions[svgfilename] = entry
+    return entry["width"], entry["height"]
+
+def update_svg_dimensions(directories):
+    "bring the persistent index up to date for all SVGs in the given directories"
+    global svg_dimensions
+    if os.path.isfile(SVG_DIMENSIONS_FILE):
+        with open(SVG_DIMENSIONS_FILE, "r") as f:
+            svg_dimensions = json.load(f)
+    svgfilenames = set()
+    for directory in directories:
+        for svgfilename in sorted(os.listdir(directory)):
+            if svgfilename.endswith(".svg"):
+                svgfilenames.add(directory + "/" + svgfilename)
+                get_svg_dimensions(directory + "/" + svgfilename)
+    svg_dimensions = {k: v for k, v in svg_dimensions.items() if k in svgfilenames}
+    os.makedirs(os.path.dirname(SVG_DIMENSIONS_FILE), exist_ok=True)
+    with open(SVG_DIMENSIONS_FILE, "w") as f:
+        json.dump(svg_dimensions, f, sort_keys=True)
+
 def _add_dimensions(tag, svgfilename):
-    with open(svgfilename, "r") as svgfile:
-        svg = minidom.parse(svgfile)
-        width_pt = svg.documentElement.getAttribute("width").replace("pt", "")
-        height_pt = svg.documentElement.getAttribute("height").replace("pt", "")
+    width_pt, height_pt = get_svg_dimensions("processed/" + svgfilename)
     width_px = float(width_pt) * 1.33333
     height_px = float(height_pt) * 1.33333
     tag['width'] = "{:.3f}".format(width_px)
     tag['height'] = "{:.3f}".format(height_px)
     return (width_px, height_px)
 
-def process_images(filename, soup):
-    "replace SVGs by PNGs if this saves filesize"
-    # Step 1: label all images explicitly tagged that they should remain an SVG
+## SVG or PNG
+# replace SVGs by PNGs except if that's a big filesize penalty
+# doing this because the SVGs are missing some features like shadows
+PNG_FACTOR = 5
+IMAGE_FORMATS_REPORT = "build-reports/image-formats.json"
+
+def _image_format_entry(svgfilename, svg_bytes, png_bytes):
+    png_filename = canonical_image(svgfilename.replace("svg", "png"))
+    use_png = png_bytes is not None and png_bytes / 1000 < PNG_FACTOR * (svg_bytes / 1000)
+    return {
+        "png": png_filename,
+        "svg_bytes": svg_bytes,
+        "png_bytes": png_bytes,
+        "format": "png" if use_png else "svg",
+    }
+
+def build_image_format_table(directory):
+    "scan the directory once and decide for every SVG whether its PNG should be used instead"
+    global image_formats
+    sizes = {entry.name: entry.stat().st_size for entry in os.scandir(directory)}
+    image_formats = {}
+    for name in sorted(sizes):
+        if name.endswith(".svg") and directory + "/" + name not in duplicate_images:
+            svgfilename = directory + "/" + name
+            png_bytes = sizes.get(os.path.basename(svgfilename.replace("svg", "png")))
+            image_formats[svgfilename] = _image_format_entry(svgfilename, sizes[name], png_bytes)
+
+def preferred_image(svgfilename):
+    "the file that should be served for svgfilename according to the format table"
+    if svgfilename not in image_formats:
+        png_filename = svgfilename.replace("svg", "png")
+        png_bytes = os.stat(png_filename).st_size if os.path.isfile(png_filename) else None
+        image_formats[svgfilename] = _image_format_entry(svgfilename, os.stat(svgfilename).st_size, png_bytes)
+    entry = image_formats[svgfilename]
+    if entry["format"] == "png":
+        return entry["png"]
+    return svgfilename
+
+def write_image_format_report():
+    "summary of the SVG/PNG choice, before the per-page exceptions (prefers-svg, library-patterns)"
+    svg_bytes = sum(entry["svg_bytes"] for entry in image_formats.values())
+    selected_bytes = sum(entry["png_bytes"] if entry["format"] == "png" else entry["svg_bytes"]
+                         for entry in image_formats.values())
+    report = {
+        "factor": PNG_FACTOR,
+        "images": len(image_formats),
+        "png": sum(1 for entry in image_formats.values() if entry["format"] == "png"),
+        "svg_bytes": svg_bytes,
+        "selected_bytes": selected_bytes,
+        "saved_bytes": svg_bytes - selected_bytes,
+        "table": image_formats,
+    }
+    os.makedirs(os.path.dirname(IMAGE_FORMATS_REPORT), exist_ok=True)
+    with open(IMAGE_FORMATS_REPORT, "w") as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    print(f"Using PNG for {report['png']} of {report['images']} images: "
+          f"{selected_bytes / 1e6:.1f} MB instead of {svg_bytes / 1e6:.1f} MB as SVG")
+
+# replace SVGs by PNGs if this saves filesize
+def mark_prefers_svg(page, div):
+    "label all images explicitly tagged that they should remain an SVG"
     # (tagging works by adding the option "svg" to the \begin{codeexample})
-    divs = soup.find_all("div", class_="prefers-svg")
-    for div in divs:
-        imgs = div.find_all("img", recursive=True)
-        for img in imgs:
-            img['class'] = img.get('class', []) + ['prefers-svg']
-    for tag in soup.find_all("img"):
-        if "svg" in tag['src']: 
-            width_px, height_px = _add_dimensions(tag, tag['src'])
-            # very large SVGs are pathological and empty, delete them
-            if height_px > 10000:
-                tag.decompose()
-                continue
-            tag["loading"] = "lazy"
-            # do not replace the following svgs
-            if "prefers-svg" in tag['class']:
-                continue
-            if "library-patterns" in filename:
-                continue
-            # replace all SVGs by PNGs except if that's a big filesize penalty
-            # doing this because the SVGs are missing some features like shadows
-            factor = 5
-            png_filename = tag['src'].replace("svg", "png")
-            if kilobytes(png_filename) < factor * kilobytes(tag['src']):
-                tag['src'] = png_filename
-    for tag in soup.find_all("object"):
-        if "svg" in tag['data']: 
-            _add_dimensions(tag, tag['data'])
-
-def rewrite_svg_links(soup):
-    for tag in soup.find_all("a"):
-        if tag.has_attr('href') and "svg" in tag['href']:
-            img = tag.img
-            if img and "inlineimage" in img['class']:
-                object = soup.new_tag('object')
-                object['data'] = img['src']
-                object['type'] = "image/svg+xml"
-                tag.replace_with(object)
-
-def add_version_to_css_js(soup):
-    "to avoid caching, add a version number to the URL"
-    today = datetime.date.today().isoformat().replace("-", "")
-    for tag in soup.find_all("link"):
-        if tag.has_attr('href') and tag['href'] == "style.css":
-            tag['href'] += "?v=" + today
-    for tag in soup.find_all("script"):
-        if tag.has_attr('src') and tag['src'] == "pgfmanual.js":
-            tag['src'] += "?v=" + today
-
-def semantic_tags(soup):
-    for example in soup.find_all(class_="example"):
-        example.name = "figure"
-    for examplecode in soup.find_all(class_="example-code"):
-        p = examplecode.find("p")
-        p.name = "code"
+    for img in div.find_all("img", recursive=True):
+        img['class'] = img.get('class', []) + ['prefers-svg']
+
+def process_image(page, tag):
+    if tag.has_attr('srcset'):
+        # visited again inside the <picture> that add_srcset wrapped around it
+        return
+    if "svg" in tag['src']:
+        tag['src'] = canonical_image(tag['src'])
+        width_px, height_px = _add_dimensions(tag, tag['src'])
+        # very large SVGs are pathological and empty, delete them
+        if height_px > 10000:
+            tag.decompose()
+            return
+        tag["loading"] = "lazy"
+        # do not replace the following svgs
+        if "prefers-svg" in tag['class']:
+            return
+        if "library-patterns" in page["filename"]:
+            return
+        tag['src'] = canonical_image(preferred_image(tag['src']))
+        variants = responsive_images.get(tag['src'], {}).get(math.ceil(width_px))
+        if variants:
+            return add_srcset(page, tag, variants, width_px)
+
+def add_object_dimensions(page, tag):
+    if "svg" in tag['data']:
+        tag['data'] = canonical_image(tag['data'])
+        _add_dimensions(tag, tag['data'])
+
+def rewrite_svg_links(page, tag):
+    if tag.has_attr('href') and "svg" in tag['href']:
+        tag['href'] = canonical_image(tag['href'])
+        img = tag.img
+        if img and "inlineimage" in img['class']:
+            object = page["soup"].new_tag('object')
+            object['data'] = canonical_image(img['src'])
+            object['type'] = "image/svg+xml"
+            tag.replace_with(object)
+            return object
+
+def _fingerprint_candidate(candidate):
+    "fingerprint the URL of one srcset candidate such as 'image.png 200w'"
+    path, _, descriptor = candidate.partition(" ")
+    return (asset_manifest.get(path, path) + " " + descriptor).rstrip()
+
+def fingerprint_asset(page, tag):
+    "to avoid caching old versions, add the hash of the file to the URL"
+    attribute = FINGERPRINTED_ATTRIBUTES[tag.name]
+    if tag.get(attribute) in asset_manifest:
+        tag[attribute] = asset_manifest[tag[attribute]]
+    if tag.has_attr('srcset'):
+        tag['srcset'] = ", ".join(_fingerprint_candidate(candidate) for candidate in tag['srcset'].split(", "))
+
+def make_example_figure(page, example):
+    example.name = "figure"
+
+def make_example_code(page, examplecode):
+    p = examplecode.find("p")
+    p.name = "code"
 
 # some texttt spans (inline code) should not get a blue background, because 
 # they appear as part of longer definitions that don't have a background
 # in particular, let's check whether they are immediately preceded
 # or succeded by another span
-def texttt_spans(soup):
-    for span in soup.find_all('span', class_='texttt') + soup.find_all('span', class_='verb'):
-        prev_sibling = span.previous_sibling
-        if prev_sibling and prev_sibling.name == 'span':
-            span['class'].append('nobackground')
-            continue
-        next_sibling = span.next_sibling
-        if next_sibling and next_sibling.name == 'span':
-            span['class'].append('nobackground')
+def texttt_span(page, span):
+    prev_sibling = span.previous_sibling
+    if prev_sibling and prev_sibling.name == 'span':
+        span['class'].append('nobackground')
+        return
+    next_sibling = span.next_sibling
+    if next_sibling and next_sibling.name == 'span':
+        span['class'].append('nobackground')
+
+def social_media_banner(filename):
+    if filename == "index-0.html":
+        return "social-media-banners/introduction.png"
+    return "social-media-banners/" + os.path.splitext(filename)[0] + ".png"
 
 def add_meta_tags(filename, soup):
     stem = os.path.splitext(filename)[0]
@@ -658,11 +913,11 @@ def add_meta_tags(filename, soup):
         soup.head.append(meta)
         og_meta = soup.new_tag('meta', property="og:description", content="Full online version of the documentation of PGF/TikZ, the TeX package for creating graphics.")
         soup.head.append(og_meta)
-    elif stem in meta_descriptions:
-        meta = soup.new_tag('meta', content=meta_descriptions[stem])
+    elif stem in get_meta_descriptions():
+        meta = soup.new_tag('meta', content=get_meta_descriptions()[stem])
         meta['name'] = "description"
         soup.head.append(meta)
-        og_meta = soup.new_tag('meta', property="og:description", content=meta_descriptions[stem])
+        og_meta = soup.new_tag('meta', property="og:description", content=get_meta_descriptions()[stem])
         soup.head.append(og_meta)
     # canonical
     if filename == "index-0.html":
@@ -676,9 +931,7 @@ def add_meta_tags(filename, soup):
         meta = soup.new_tag('meta', property="og:url", content="https://tikz.dev/" + stem)
         soup.head.append(meta)
     # thumbnail
-    img_filename = "social-media-banners/" + stem + ".png"
-    if filename == "index-0.html":
-        img_filename = "social-media-banners/introduction.png"
+    img_filename = social_media_banner(filename)
     if os.path.isfile("banners/"+img_filename):
         meta = soup.new_tag('meta', property="og:image", content="https://tikz.dev/" + img_filename)
         soup.head.append(meta)
@@ -697,27 +950,31 @@ def add_meta_tags(filename, soup):
     meta['name'] = "twitter:card"
     soup.head.append(meta)
 
-def add_spotlight_toc(filename):
-    spotlight_files = ["index", "tutorials-guidelines", "tikz", "libraries", "gd", "dv"]
-    if not any(filename == x + ".html" for x in spotlight_files):
-        return
-    # read as string
-    with open("processed/"+filename, "r") as f:
-        html = f.read()
-    # read replacement string
+## post-serialization hooks
+# string-level patches of the written page. Every hook is called with the name
+# of the output file and returns a function that patches the page text, or
+# None if it does not apply to that page. The patches of a page are applied
+# in the order of POST_SERIALIZATION_HOOKS while write_to_file writes it.
+SPOTLIGHT_PAGES = ["index", "tutorials-guidelines", "tikz", "libraries", "gd", "dv"]
+
+@functools.lru_cache(maxsize=None)
+def read_spotlight_toc(filename):
     with open("spotlight-tocs/spotlight-toc-"+filename, "r") as f:
-        toc = f.read()
-    # replace
+        return f.read()
+
+spotlight_image_pattern = re.compile(r'src="(toc-banners/[^"]+)"')
+
+def add_spotlight_toc(filename):
+    if not any(filename == x + ".html" for x in SPOTLIGHT_PAGES):
+        return None
+    toc = spotlight_image_pattern.sub(lambda m: f'src="{asset_manifest.get(m[1], m[1])}"', read_spotlight_toc(filename))
     if filename == "index.html":
-        html = html.replace('<div class="titlepagepic">', toc)
-    else:
-        html = html.replace('</section>', toc+'</section>')
-    # write back
-    with open("processed/"+filename, "w") as f:
-        f.write(html)
+        return lambda html: html.replace('<div class="titlepagepic">', toc)
+    return lambda html: html.replace('</section>', toc+'</section>')
 
 def add_quicklinks(filename):
-    assert filename == "index.html"
+    if filename != "index.html":
+        return None
     quicklinks = """
         <div class="quicklinks">
             <strong>Quick Links</strong>
@@ -737,18 +994,20 @@ def add_quicklinks(filename):
         </div>
         """
     pattern = '<div class="home-toc-section">'
-    with open("processed/"+filename, "r") as f:
-        html = f.read()
-        html = html.replace(pattern, quicklinks + pattern, 1)
-    with open("processed/"+filename, "w") as f:
-        f.write(html)
+    added = False
+    def patch(html):
+        # only before the first occurrence
+        nonlocal added
+        if added or pattern not in html:
+            return html
+        added = True
+        return html.replace(pattern, quicklinks + pattern, 1)
+    return patch
 
 def add_pgfplots_ad(filename):
     if not "index" in filename:
-        return
-    with open("processed/"+filename, "r") as f:
-        html = f.read()
-        html = html.replace('<div id="search"></div>', """<!-- temporary ad for new pgfplots pages -->
+        return None
+    ad = """<!-- temporary ad for new pgfplots pages -->
         <div id="pgfplots-link">
           <a href="https://tikz.dev/pgfplots">
             <span id="pgfplots-desktop-version">
@@ -761,93 +1020,1388 @@ def add_pgfplots_ad(filename):
             </span>
           </a>
         </div>
-        <div id="search"></div>""")
-    with open("processed/"+filename, "w") as f:
-        f.write(html)
+        <div id="search"></div>"""
+    return lambda html: html.replace('<div id="search"></div>', ad)
+
+POST_SERIALIZATION_HOOKS = [add_spotlight_toc, add_quicklinks, add_pgfplots_ad]
+
+def page_patches(filename):
+    "the patches of all hooks that apply to the output file filename"
+    patches = [hook(filename) for hook in POST_SERIALIZATION_HOOKS]
+    return [patch for patch in patches if patch is not None]
 
-def handle_code_spaces(soup):
+def remove_numsp_tag(page, tag):
     # these are throwaway tags, only used to avoid overfull boxes
-    for tag in soup.find_all(class_="numsp"):
-        tag.decompose()
+    tag.decompose()
+
+def strip_code_links(page, codeblock):
     # some links within codes have extra spaces, strip them
-    for codeblock in soup.find_all(class_="example-code"):
-        for link in codeblock.find_all("a"):
-            link.string = link.string.strip()
+    for link in codeblock.find_all("a"):
+        link.string = link.string.strip()
 
-for filename in sorted(os.listdir()):
-    if filename.endswith(".html"):
-        if filename in ["description.html", "pgfmanual_html.html", "home.html"] or "spotlight" in filename:
-            continue
-        else:
-            print(f"Processing {filename}")
-            with open(filename, "r") as fp:
-                soup = BeautifulSoup(fp, 'html5lib')
-                add_footer(soup)
-                shorten_sidetoc_and_add_part_header(soup, is_home=(filename == "index-0.html"))
-                rearrange_heading_anchors(soup)
-                make_page_toc(soup)
-                remove_mathjax_if_possible(filename, soup)
-                make_entryheadline_anchor_links(soup)
-                remove_html_from_links(filename, soup)
-                remove_useless_elements(soup)
-                addClipboardButtons(soup)
-                rewrite_svg_links(soup)
-                add_version_to_css_js(soup)
-                process_images(filename, soup)
-                add_header(soup)
-                favicon(soup)
-                semantic_tags(soup)
-                texttt_spans(soup)
-                add_meta_tags(filename, soup)
-                add_copyright_comment_block(filename, soup)
-                handle_code_spaces(soup)
-                soup.find(class_="bodyandsidetoc")['class'].append("grid-container")
-                if filename == "index-0.html":
-                    soup.h4.decompose() # don't need header on start page
-                    soup.body['class'] = "index-page"
-                    add_version_date(soup)
-                    write_to_file(soup, "processed/index.html")
-                    add_spotlight_toc("index.html")
-                    add_quicklinks("index.html")
-                    add_pgfplots_ad("index.html")
-                else:
-                    write_to_file(soup, "processed/"+filename)
-                    add_spotlight_toc(filename)
-                    add_pgfplots_ad(filename)
+# runs of numspaces, plus the two ugly hacks below, found in a single scan
+numspace_pattern = re.compile(r'(?:&numsp;)+|<a href="drivers#pgf\.class">class</a>|<bar></bar>')
+NUMSPACE_RUN = 30
+NUMSPACE_OPENERS = ">}],"
+NUMSPACE_CLOSERS = "<{["
 
-# prettify
-# run command with subprocess
-print("Prettifying")
-subprocess.run(["prettier", "--print-width", "140", "--write", "processed/*.html"])
+def _numspace_replacement(match, filename):
+    text = match.group()
+    if text[0] != "&":
+        # ugly hack to fix https://github.com/DominikPeters/tikz.dev-issues/issues/16
+        if text.startswith("<a"):
+            return 'class'
+        # ugly hack to fix https://github.com/DominikPeters/tikz.dev-issues/issues/46
+        if filename == 'pgfkeys.html':
+            return '&lt;bar&gt;'
+        return text
+    # long runs are split into spans of at most NUMSPACE_RUN spaces
+    count = len(text) // len("&numsp;")
+    spans = []
+    while count >= 2:
+        num_copies = min(count, NUMSPACE_RUN)
+        spans.append('<span class="spaces">'+' '*num_copies+'</span>')
+        count -= num_copies
+    if count == 1:
+        html = match.string
+        before = spans[-1][-1] if spans else html[match.start()-1:match.start()]
+        after = html[match.end():match.end()+1]
+        if before and before in NUMSPACE_OPENERS and after and after in NUMSPACE_CLOSERS:
+            spans.append(" ")
+        else:
+            spans.append('<span class="spaces"> </span>')
+    return "".join(spans)
 
 def numspace_to_spaces(filename):
     "replace numspaces by normal spaces in code blocks"
     with open("processed/"+filename, "r") as f:
         html = f.read()
-    for num_copies in range(30,1,-1):
-        pattern = "&numsp;"*num_copies
-        replacement = '<span class="spaces">'+' '*num_copies+'</span>'
-        html = html.replace(pattern, replacement)
-    for opener in [">", "}", "]", ","]:
-        for closer in ["<", "{", "["]:
-            pattern = opener+"&numsp;"+closer
-            replacement = opener+" "+closer
-            html = html.replace(pattern, replacement)
-    html = html.replace("&numsp;", '<span class="spaces"> </span>')
-    # ugly hack to fix https://github.com/DominikPeters/tikz.dev-issues/issues/16
-    html = html.replace('<a href="drivers#pgf.class">class</a>', 'class')
-    # ugly hack to fix https://github.com/DominikPeters/tikz.dev-issues/issues/46
     if filename == 'pgfkeys.html':
         assert '<bar></bar>' in html
-        html = html.replace('<bar></bar>','&lt;bar&gt;')
+    html = numspace_pattern.sub(lambda match: _numspace_replacement(match, filename), html)
     with open("processed/"+filename, "w") as f:
         f.write(html)
 
-for filename in sorted(os.listdir()):
-    if filename.endswith(".html"):
-        if filename in ["index-0.html", "description.html", "pgfmanual_html.html", "home.html"] or "spotlight" in filename:
+## incremental builds
+# the manifest records a hash of every input of every processed page,
+# so that pages whose inputs have not changed since the last run are skipped
+MANIFEST_FILE = ".build-cache/manifest.json"
+referenced_image_pattern = re.compile(r'"((?:pgfmanual-images|standalone)/[^"]+\.svg)"')
+# hashes of the files read in earlier runs, by path, reused while their mtime and
+# size stay the same, so that unchanged images are not read again on every run
+FILE_HASHES_FILE = ".build-cache/file-hashes.json"
+_file_hashes = {}
+_file_hash_index = None
+
+def file_hash(filename):
+    "sha256 of the file contents, or None if the file does not exist (memoized for this run)"
+    global _file_hash_index
+    if filename not in _file_hashes:
+        if _file_hash_index is None:
+            _file_hash_index = {}
+            if os.path.isfile(FILE_HASHES_FILE):
+                with open(FILE_HASHES_FILE, "r") as f:
+                    _file_hash_index = json.load(f)
+        if os.path.isfile(filename):
+            st = os.stat(filename)
+            entry = _file_hash_index.get(filename)
+            if entry is None or entry["mtime"] != st.st_mtime_ns or entry["size"] != st.st_size:
+                with open(filename, "rb") as f:
+                    entry = {"mtime": st.st_mtime_ns, "size": st.st_size, "hash": hashlib.sha256(f.read()).hexdigest()}
+                _file_hash_index[filename] = entry
+            _file_hashes[filename] = entry["hash"]
+        else:
+            _file_hashes[filename] = None
+    return _file_hashes[filename]
+
+def save_file_hashes():
+    "keep the hashes of the files used in this run for the next one"
+    index = {filename: entry for filename, entry in (_file_hash_index or {}).items() if filename in _file_hashes}
+    os.makedirs(os.path.dirname(FILE_HASHES_FILE), exist_ok=True)
+    with open(FILE_HASHES_FILE, "w") as f:
+        json.dump(index, f, sort_keys=True)
+
+def string_hash(string):
+    return hashlib.sha256(string.encode("utf-8")).hexdigest()
+
+def output_filename(filename):
+    "the home page index-0.html is written to processed/index.html"
+    if filename == "index-0.html":
+        return "index.html"
+    return filename
+
+def page_inputs(filename):
+    "hashes of everything the processed version of a page depends on"
+    stem = os.path.splitext(filename)[0]
+    inputs = {
+        "script": file_hash(os.path.abspath(__file__)),
+        "parser": html_parser,
+        "destinations": string_hash(json.dumps(get_destinations(), sort_keys=True)),
+        "html": file_hash(filename),
+        "copyright": string_hash("\n".join(read_copyright_lines(filename))),
+        "meta-description": string_hash(json.dumps(get_meta_descriptions().get(stem))),
+        "spotlight-toc": file_hash("spotlight-tocs/spotlight-toc-" + output_filename(filename)),
+        # add_meta_tags only links the banner if it exists, so its absence (None) counts as well
+        "social-media-banner": file_hash("banners/" + social_media_banner(filename)),
+        # every page links the stylesheets and scripts, the spotlight tables of contents show the toc banners
+        "assets": string_hash(json.dumps([asset_manifest.get(path) for path in ASSET_FILES]
+                                         + sorted(url for path, url in asset_manifest.items() if path.startswith("toc-banners/")))),
+    }
+    if filename == "index-0.html":
+        inputs["commit-date"] = commit_date
+    if inline_svg_bytes:
+        inputs["inline-svg-bytes"] = inline_svg_bytes
+    with open(filename, "r") as f:
+        html = f.read()
+    for svg_filename in sorted(set(referenced_image_pattern.findall(html))):
+        inputs[svg_filename] = file_hash(svg_filename)
+        png_filename = svg_filename.replace("svg", "png")
+        inputs[png_filename] = file_hash(png_filename)
+        for image in [svg_filename, png_filename]:
+            if image in duplicate_images:
+                inputs[image + " canonical"] = duplicate_images[image]
+        if png_filename in responsive_images:
+            inputs[png_filename + " variants"] = string_hash(json.dumps(responsive_images[png_filename]))
+    return inputs
+
+def load_manifest():
+    if not os.path.isfile(MANIFEST_FILE):
+        return {"pages": {}}
+    with open(MANIFEST_FILE, "r") as f:
+        return json.load(f)
+
+def save_manifest(manifest):
+    os.makedirs(os.path.dirname(MANIFEST_FILE), exist_ok=True)
+    with open(MANIFEST_FILE, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+## formatting
+# prettier only formats the pages written in this run. The formatted output is
+# cached under the hash of the unformatted page, so pages that serialize to the
+# same HTML as in an earlier run are not formatted again. Every page keeps only
+# its latest entry, the others would never be used again (the footer has the date).
+# (clear the cache after upgrading prettier)
+PRETTIER_CACHE_DIRECTORY = ".build-cache/prettier"
+PRETTIER_COMMAND = ["prettier", "--print-width", "140", "--write"]
+
+def prettier_cache_file(path):
+    with open(path, "rb") as f:
+        key = hashlib.sha256(f.read())
+    key.update(" ".join(PRETTIER_COMMAND).encode())
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(PRETTIER_CACHE_DIRECTORY, stem + "-" + key.hexdigest() + ".html")
+
+def prune_prettier_cache(cache_files):
+    "remove the older entries of the given pages, and those of pages that no longer exist"
+    if not os.path.isdir(PRETTIER_CACHE_DIRECTORY):
+        return
+    current = {os.path.basename(cache_file) for cache_file in cache_files.values()}
+    stems = {os.path.splitext(os.path.basename(path))[0] for path in cache_files}
+    for name in os.listdir(PRETTIER_CACHE_DIRECTORY):
+        stem = name.rsplit("-", 1)[0]
+        if name not in current and (stem in stems or not os.path.isfile("processed/" + stem + ".html")):
+            os.remove(os.path.join(PRETTIER_CACHE_DIRECTORY, name))
+
+def run_prettier(paths):
+    "format one shard of pages with a single prettier process, returning whether it succeeded"
+    result = subprocess.run(PRETTIER_COMMAND + paths)
+    return result.returncode == 0
+
+def format_pages(paths, jobs=1):
+    """run prettier on the given files, using the cache and up to jobs prettier processes at once,
+    returning the files that could not be formatted"""
+    cache_files = {path: prettier_cache_file(path) for path in paths}
+    to_format = []
+    for path in paths:
+        if os.path.isfile(cache_files[path]):
+            copyfile(cache_files[path], path)
+        else:
+            to_format.append(path)
+    if len(to_format) < len(paths):
+        print(f"Using cached formatting for {len(paths) - len(to_format)} pages")
+    prune_prettier_cache(cache_files)
+    if not to_format:
+        return []
+    # every prettier process starts Node, so use a few large shards rather than many small ones
+    num_shards = max(1, min(jobs, len(to_format)))
+    shards = [to_format[i::num_shards] for i in range(num_shards)]
+    with ThreadPoolExecutor(max_workers=num_shards) as executor:
+        results = list(executor.map(run_prettier, shards))
+    os.makedirs(PRETTIER_CACHE_DIRECTORY, exist_ok=True)
+    failed = []
+    for shard, succeeded in zip(shards, results):
+        if not succeeded:
+            print("prettier failed on " + ", ".join(shard))
+            failed.extend(shard)
             continue
+        for path in shard:
+            copyfile(path, cache_files[path])
+    return failed
+
+## image deduplication
+# lwarp writes a file for every lateximage and make-standalones.py one for every
+# animation, and many of them are byte-identical (arrow tips, plot marks, steps
+# of the tutorials). Of every group of identical images, only the first (by path)
+# is put into processed/, and the pages reference it instead of the others, so
+# that browsers download it once and find it in their cache on the other pages.
+DEDUPLICATED_EXTENSIONS = [".svg", ".png"]
+DEDUPLICATION_REPORT = "build-reports/image-duplicates.json"
+# path of a duplicate -> path of its canonical copy
+duplicate_images = {}
+
+def _deduplicated(directory, name):
+    "the lwarp images and the animations, but not the other files of standalone/ (which style.css may use)"
+    if os.path.splitext(name)[1] not in DEDUPLICATED_EXTENSIONS:
+        return False
+    return directory == SVGO_DIRECTORY or (directory == "standalone" and "-animation-" in name)
+
+def canonical_image(path):
+    return duplicate_images.get(path, path)
+
+def find_duplicate_images():
+    "group the images by their hash and map every one but the first of each group to the first"
+    global duplicate_images
+    groups = {}
+    for directory in [SVGO_DIRECTORY, "standalone"]:
+        names = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+        for name in names:
+            if _deduplicated(directory, name):
+                path = directory + "/" + name
+                groups.setdefault(file_hash(path), []).append(path)
+    duplicate_images = {}
+    for paths in groups.values():
+        for path in paths[1:]:
+            duplicate_images[path] = paths[0]
+
+def write_deduplication_report(filenames):
+    """bytes saved by deduplication, and how many of the images that the pages reference
+    a visitor of all pages would find in the browser cache, before and after"""
+    references = {"before": 0, "after": 0}
+    downloads = {"before": set(), "after": set()}
+    for filename in filenames:
+        with open(filename, "r") as f:
+            images = set(referenced_image_pattern.findall(f.read()))
+        canonical = {canonical_image(image) for image in images}
+        references["before"] += len(images)
+        references["after"] += len(canonical)
+        downloads["before"].update(images)
+        downloads["after"].update(canonical)
+    groups = {}
+    for duplicate, canonical in sorted(duplicate_images.items()):
+        groups.setdefault(canonical, []).append(duplicate)
+    saved_bytes = sum(os.path.getsize("processed/" + canonical) * len(duplicates)
+                      for canonical, duplicates in groups.items() if os.path.isfile("processed/" + canonical))
+    report = {
+        "duplicates": len(duplicate_images),
+        "saved_bytes": saved_bytes,
+        "downloads_before": len(downloads["before"]),
+        "downloads_after": len(downloads["after"]),
+        "cache_hits_before": references["before"] - len(downloads["before"]),
+        "cache_hits_after": references["after"] - len(downloads["after"]),
+        "groups": groups,
+    }
+    os.makedirs(os.path.dirname(DEDUPLICATION_REPORT), exist_ok=True)
+    with open(DEDUPLICATION_REPORT, "w") as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    print(f"Deduplicated {report['duplicates']} images, saving {saved_bytes / 1e6:.1f} MB: "
+          f"all pages together download {report['downloads_after']} instead of {report['downloads_before']} SVGs, "
+          f"{report['cache_hits_after']} instead of {report['cache_hits_before']} come from the cache")
+
+## asset sync
+# the static files are copied into processed/ only if they are new or changed,
+# and files that no longer exist in a synced directory are removed from processed/
+ASSET_FILES = ["style.css", "lwarp.css", "pgfmanual.js", "lwarp-mathjax-emulation.js"]
+STYLESHEETS = [filename for filename in ASSET_FILES if filename.endswith(".css")]
+ASSET_DIRECTORIES = {
+    "pgfmanual-images": "processed/pgfmanual-images",
+    "standalone": "processed/standalone",
+    "banners/social-media-banners": "processed/social-media-banners",
+    "banners/toc-banners": "processed/toc-banners",
+}
+SYNC_METHODS = ["copy", "hardlink", "reflink"]
+SYNC_CHECKS = ["mtime", "hash"]
+FICLONE = 0x40049409 # ioctl for reflinks on Linux (btrfs, xfs)
+
+def _asset_unchanged(source, target, check):
+    try:
+        source_stat = os.stat(source)
+        target_stat = os.stat(target)
+    except FileNotFoundError:
+        return False
+    if source_stat.st_size != target_stat.st_size:
+        return False
+    if check == "hash":
+        return file_hash(source) == file_hash(target)
+    return source_stat.st_mtime_ns == target_stat.st_mtime_ns
+
+def _reflink(source, target):
+    "copy-on-write copy, falling back to a normal copy where the file system does not support it"
+    try:
+        with open(source, "rb") as source_file, open(target, "wb") as target_file:
+            fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+    except OSError:
+        copy2(source, target)
+        return
+    stat = os.stat(source)
+    os.utime(target, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+def _transfer_asset(source, target, method):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.lexists(target):
+        # never write through a hardlink into the source file
+        os.remove(target)
+    if method == "hardlink":
+        os.link(source, target)
+    elif method == "reflink":
+        _reflink(source, target)
+    else:
+        # copy2 keeps the modification time, which the next run compares
+        copy2(source, target)
+
+def sync_assets(method="copy", check="mtime"):
+    "bring the static files in processed/ up to date, printing how much copying was avoided"
+    # the stylesheets are written by build_asset_manifest, with fingerprinted url()s
+    pairs = [(filename, "processed/" + filename) for filename in ASSET_FILES if filename not in STYLESHEETS]
+    for source_directory, target_directory in ASSET_DIRECTORIES.items():
+        sources = set()
+        for directory, _, filenames in os.walk(source_directory, followlinks=True):
+            # also create empty directories
+            os.makedirs(os.path.join(target_directory, os.path.relpath(directory, source_directory)), exist_ok=True)
+            for filename in filenames:
+                source = os.path.join(directory, filename)
+                if source in duplicate_images:
+                    # the pages use the canonical copy
+                    continue
+                relative = os.path.relpath(source, source_directory)
+                sources.add(relative)
+                if directory == SVGO_DIRECTORY and filename.endswith(".svg"):
+                    # placed by optimize_svgs
+                    continue
+                pairs.append((source, os.path.join(target_directory, relative)))
+        removed = 0
+        for directory, _, filenames in os.walk(target_directory):
+            for filename in filenames:
+                target = os.path.join(directory, filename)
+                relative = os.path.relpath(target, target_directory)
+                if compressed_source(relative) in sources:
+                    # written by compress_processed_files
+                    continue
+                if responsive_source(relative) in sources:
+                    # placed by build_responsive_images
+                    continue
+                if relative not in sources:
+                    os.remove(target)
+                    removed += 1
+        if removed:
+            print(f"Removed {removed} stale files from {target_directory}")
+    transferred = transferred_bytes = skipped_bytes = 0
+    for source, target in pairs:
+        if _asset_unchanged(source, target, check):
+            skipped_bytes += os.path.getsize(source)
+            continue
+        _transfer_asset(source, target, method)
+        transferred += 1
+        transferred_bytes += os.path.getsize(source)
+    print(f"Synced assets ({method}): {transferred} of {len(pairs)} files changed, "
+          f"{transferred_bytes / 1e6:.1f} MB transferred, {skipped_bytes / 1e6:.1f} MB not copied")
+
+## SVG optimization
+# the SVGs in pgfmanual-images are optimized with svgo. The results are cached
+# under the hash of the original file, so every figure is optimized only once,
+# and optimize_svgs (rather than sync_assets) puts them into processed/.
+SVGO_DIRECTORY = "pgfmanual-images"
+SVGO_CACHE_DIRECTORY = ".build-cache/svgo"
+SVGO_BATCH_SIZE = 200
+
+def _svgo_cache_file(key):
+    return os.path.join(SVGO_CACHE_DIRECTORY, key + ".svg")
+
+def _complete_svg(path):
+    "whether svgo wrote the whole file (it may have been interrupted on a failure)"
+    if not os.path.isfile(path):
+        return False
+    with open(path, "rb") as f:
+        return f.read().rstrip().endswith(b"</svg>")
+
+def _run_svgo(batch):
+    """optimize a batch of (source, hash) pairs into the cache with one svgo process, returning whether
+    this worked for all of them. If svgo fails on some files, the others are still cached, so that the
+    next run only tries the failed ones again."""
+    with tempfile.TemporaryDirectory(dir=SVGO_CACHE_DIRECTORY) as directory:
+        inputs = os.path.join(directory, "in")
+        outputs = os.path.join(directory, "out")
+        os.makedirs(inputs)
+        os.makedirs(outputs)
+        for source, key in batch:
+            copyfile(source, os.path.join(inputs, key + ".svg"))
+        try:
+            svgo = subprocess.run(["svgo", "--quiet", "-f", inputs, "-o", outputs], capture_output=True)
+        except FileNotFoundError:
+            return False
+        if svgo.returncode != 0:
+            print(f"svgo exited with code {svgo.returncode}: {svgo.stderr.decode().strip()}")
+        complete = True
+        for source, key in batch:
+            optimized = os.path.join(outputs, key + ".svg")
+            if not _complete_svg(optimized):
+                complete = False
+                continue
+            os.replace(optimized, _svgo_cache_file(key))
+    return complete and svgo.returncode == 0
+
+def optimize_svgs(jobs=1, method="copy"):
+    "put optimized versions of the SVGs into processed/, running svgo on the ones that are not cached yet"
+    os.makedirs(SVGO_CACHE_DIRECTORY, exist_ok=True)
+    names = sorted(name for name in os.listdir(SVGO_DIRECTORY)
+                   if name.endswith(".svg") and os.path.join(SVGO_DIRECTORY, name) not in duplicate_images)
+    keys = {name: file_hash(os.path.join(SVGO_DIRECTORY, name)) for name in names}
+    misses = {}
+    for name in names:
+        if keys[name] not in misses and not os.path.isfile(_svgo_cache_file(keys[name])):
+            misses[keys[name]] = os.path.join(SVGO_DIRECTORY, name)
+    if misses:
+        print(f"Optimizing {len(misses)} SVGs")
+        pairs = [(source, key) for key, source in misses.items()]
+        batches = [pairs[i:i + SVGO_BATCH_SIZE] for i in range(0, len(pairs), SVGO_BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            if not all(executor.map(_run_svgo, batches)):
+                print("Could not run svgo on all SVGs, using the unoptimized files for the others")
+    placed = 0
+    for name in names:
+        # fall back to the unoptimized file if svgo failed
+        source = _svgo_cache_file(keys[name])
+        if not os.path.isfile(source):
+            source = os.path.join(SVGO_DIRECTORY, name)
+        target = os.path.join("processed", SVGO_DIRECTORY, name)
+        if not _asset_unchanged(source, target, "mtime"):
+            _transfer_asset(source, target, method)
+            placed += 1
+    print(f"Placed {placed} of {len(names)} SVGs into processed/")
+
+## responsive images
+# the PNGs are rendered at 300 dpi, about three times the resolution that a
+# normal screen needs. Every PNG that is served instead of its SVG also gets
+# copies at 1x and 2x its displayed width (optionally also as AVIF or WebP),
+# which process_image offers with srcset and sizes, so that phones only download
+# the resolution they need. The copies are cached under the hash of the PNG.
+# Pillow is optional: without it, the PNGs are served as before.
+RESPONSIVE_CACHE_DIRECTORY = ".build-cache/responsive"
+RESPONSIVE_INDEX_FILE = ".build-cache/responsive/index.json"
+RESPONSIVE_DENSITIES = [1, 2]
+# the optional formats, in the order in which browsers should prefer them
+RESPONSIVE_FORMATS = ["avif", "webp"]
+RESPONSIVE_MIME_TYPES = {"avif": "image/avif", "webp": "image/webp"}
+RESPONSIVE_SAVE_OPTIONS = {"png": {"optimize": True}, "webp": {"quality": 90, "method": 6}, "avif": {"quality": 80}}
+responsive_variant_pattern = re.compile(r"^(.*)-\d+w\.(?:png|webp|avif)$")
+# PNG path -> displayed width (rounded up) -> {format: [(path, width in pixels), ...] from small to large}
+responsive_images = {}
+
+def responsive_source(filename):
+    "the PNG that filename is a resized variant of, or None"
+    match = responsive_variant_pattern.match(filename)
+    if match:
+        return match.group(1) + ".png"
+    return None
+
+def _variant_widths(display_width, source_width, formats):
+    """widths of the variants in every format. PNG variants that would not be smaller
+    than the source are left out, the other formats also get one at the full width"""
+    widths = sorted({math.ceil(display_width * density) for density in RESPONSIVE_DENSITIES})
+    widths = [width for width in widths if width < source_width]
+    return {format: widths if format == "png" else widths + [source_width] for format in formats}
+
+def _responsive_cache_file(key, width, format):
+    return os.path.join(RESPONSIVE_CACHE_DIRECTORY, f"{key}-{width}w.{format}")
+
+def _resize_png(task):
+    """write the missing variants of one PNG for all of its displayed widths into the cache,
+    returning its hash, its width and an error message (the width is None if it cannot be read)"""
+    source, key, display_widths, formats = task
+    from PIL import Image
+    try:
+        with Image.open(source) as image:
+            image.load()
+            targets = set()
+            for display_width in display_widths:
+                for format, widths in _variant_widths(display_width, image.width, formats).items():
+                    targets.update((format, width) for width in widths)
+            for format, width in sorted(targets):
+                target = _responsive_cache_file(key, width, format)
+                if os.path.isfile(target):
+                    continue
+                height = max(1, round(image.height * width / image.width))
+                resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+                # write atomically, so that an interrupted build leaves no broken cache entries
+                temporary = f"{target}.{os.getpid()}.tmp"
+                resized.save(temporary, format=format, **RESPONSIVE_SAVE_OPTIONS[format])
+                os.replace(temporary, target)
+            return key, image.width, None
+    except OSError as error:
+        # printed by the parent, so that the messages of the workers don't interleave
+        return key, None, f"Could not resize {source}: {error}"
+
+def build_responsive_images(extra_formats=(), jobs=1, method="copy"):
+    "derive the variants of the PNGs that replace SVGs and place them into processed/"
+    global responsive_images
+    responsive_images = {}
+    # (PNG, displayed width) of every SVG that is replaced by a PNG
+    images = set()
+    try:
+        from PIL import features
+    except ImportError:
+        print("Pillow is not installed, serving the PNGs without smaller variants")
+    else:
+        formats = [format for format in RESPONSIVE_FORMATS if format in extra_formats]
+        for format in formats:
+            if not features.check(format):
+                print(f"Pillow cannot write {format.upper()}, leaving it out")
+        formats = [format for format in formats if features.check(format)] + ["png"]
+        for svgfilename, entry in sorted(image_formats.items()):
+            width_pt, _ = get_svg_dimensions("processed/" + svgfilename)
+            if entry["format"] == "png" and width_pt:
+                images.add((entry["png"], float(width_pt) * 1.33333))
+    images = sorted(images)
+    # the source PNG has the same content as its copy in processed/, and its hash is memoized
+    keys = {png: file_hash(png) for png, _ in images}
+    os.makedirs(RESPONSIVE_CACHE_DIRECTORY, exist_ok=True)
+    index = {}
+    if os.path.isfile(RESPONSIVE_INDEX_FILE):
+        with open(RESPONSIVE_INDEX_FILE, "r") as f:
+            index = json.load(f)
+
+    def cached(key, display_width):
+        if key not in index:
+            return False
+        if index[key] is None:
+            return True
+        return all(os.path.isfile(_responsive_cache_file(key, width, format))
+                   for format, widths in _variant_widths(display_width, index[key], formats).items()
+                   for width in widths)
+
+    # one task per distinct PNG, so that no two workers write the same cache file
+    tasks = {}
+    for png, display_width in images:
+        key = keys[png]
+        if not cached(key, display_width):
+            task = tasks.setdefault(key, ("processed/" + png, key, [], formats))
+            task[2].append(display_width)
+    if tasks:
+        print(f"Resizing {len(tasks)} PNGs")
+        if jobs <= 1:
+            results = [_resize_png(task) for task in tasks.values()]
         else:
-            numspace_to_spaces(filename)
+            with multiprocessing.Pool(jobs) as pool:
+                results = pool.map(_resize_png, tasks.values())
+        for key, width, error in results:
+            if error:
+                print(error)
+            index[key] = width
+        with open(RESPONSIVE_INDEX_FILE, "w") as f:
+            json.dump(index, f, sort_keys=True)
+
+    placed = 0
+    targets = set()
+    png_bytes = smallest_bytes = 0
+    for png, display_width in images:
+        key = keys[png]
+        source_width = index.get(key)
+        if source_width is None:
+            continue
+        stem = os.path.splitext(png)[0]
+        variants = {}
+        for format, widths in _variant_widths(display_width, source_width, formats).items():
+            variants[format] = []
+            for width in widths:
+                cache_file = _responsive_cache_file(key, width, format)
+                if not os.path.isfile(cache_file):
+                    # resizing failed, leave the variant out
+                    continue
+                path = f"{stem}-{width}w.{format}"
+                target = "processed/" + path
+                targets.add(target)
+                if not _asset_unchanged(cache_file, target, "mtime"):
+                    _transfer_asset(cache_file, target, method)
+                    placed += 1
+                variants[format].append((path, width))
+        variants["png"].append((png, source_width))
+        responsive_images.setdefault(png, {})[math.ceil(display_width)] = variants
+        png_bytes += os.path.getsize(png)
+        smallest_bytes += os.path.getsize("processed/" + variants["png"][0][0])
+    # variants of PNGs that are no longer used (or of a build without Pillow)
+    for name in os.listdir("processed/" + SVGO_DIRECTORY):
+        target = os.path.join("processed", SVGO_DIRECTORY, name)
+        if responsive_source(name) and target not in targets and not os.path.isfile(os.path.join(SVGO_DIRECTORY, name)):
+            os.remove(target)
+    if responsive_images:
+        print(f"Placed {placed} resized variants of {len(responsive_images)} PNGs: the smallest ones are "
+              f"{smallest_bytes / 1e6:.1f} MB instead of {png_bytes / 1e6:.1f} MB")
+
+def _srcset(candidates):
+    return ", ".join(f"{path} {width}w" for path, width in candidates)
+
+def add_srcset(page, tag, variants, width_px):
+    "offer the resized variants of the PNG, wrapping the image in a <picture> for the other formats"
+    sizes = "(max-width: {0}px) 100vw, {0}px".format(math.ceil(width_px))
+    tag['src'] = variants["png"][0][0]
+    tag['srcset'] = _srcset(variants["png"])
+    tag['sizes'] = sizes
+    if len(variants) == 1:
+        return None
+    picture = page["soup"].new_tag("picture")
+    tag.wrap(picture)
+    for format in RESPONSIVE_FORMATS:
+        if format in variants:
+            source = page["soup"].new_tag("source")
+            source['type'] = RESPONSIVE_MIME_TYPES[format]
+            source['srcset'] = _srcset(variants[format])
+            source['sizes'] = sizes
+            tag.insert_before(source)
+    return picture
+
+## inline SVGs
+# with --inline-svgs BYTES, the SVGs from pgfmanual-images up to that size are
+# put into the page as <svg> elements instead of being referenced by an <img> or
+# <object>, which saves a request per file. The IDs in an inlined SVG (glyphs,
+# clip paths) get a prefix per copy, so that they cannot clash within the page.
+# Larger SVGs stay external (the <img> ones are loaded lazily), and so do SVGs with
+# a stylesheet or a script, whose rules would apply to the whole page.
+INLINE_SVGS_REPORT = "build-reports/inline-svgs.json"
+SVG_NAMESPACES = {"{http://www.w3.org/2000/svg}": "", "{http://www.w3.org/1999/xlink}": "xlink:"}
+svg_id_pattern = re.compile(r'(\sid="|href="#|url\(#)')
+inline_svg_bytes = 0
+# filename -> the image URLs that the page still requests and the inlined SVGs
+image_requests = {}
+
+def _svg_name(name):
+    "tag or attribute name without the ElementTree namespace"
+    for namespace, prefix in SVG_NAMESPACES.items():
+        if name.startswith(namespace):
+            return prefix + name[len(namespace):]
+    if name.startswith("{"):
+        raise ValueError(f"cannot inline {name}")
+    return name
+
+def _svg_element(soup, element):
+    "convert an ElementTree element into a Tag of soup, keeping the case of names such as viewBox"
+    tag = soup.new_tag(_svg_name(element.tag), attrs={_svg_name(k): v for k, v in element.attrib.items()})
+    if element.text:
+        tag.append(NavigableString(element.text))
+    for child in element:
+        tag.append(_svg_element(soup, child))
+        if child.tail:
+            tag.append(NavigableString(child.tail))
+    return tag
+
+@functools.lru_cache(maxsize=None)
+def read_inlinable_svg(path):
+    "the contents of processed/path if it can be inlined, or None"
+    filename = "processed/" + path
+    if not os.path.isfile(filename) or os.path.getsize(filename) > inline_svg_bytes:
+        return None
+    with open(filename, "r") as f:
+        svg = f.read()
+    if "<style" in svg or "<script" in svg:
+        return None
+    return svg
+
+def inline_svg(page, tag):
+    "replace a reference to a small SVG by the SVG itself, counting the requests of the page"
+    path = tag.get('src' if tag.name == "img" else 'data')
+    if path is None:
+        return
+    requests = image_requests[page["filename"]]
+    svg = None
+    if inline_svg_bytes and path.startswith(SVGO_DIRECTORY + "/") and path.endswith(".svg"):
+        svg = read_inlinable_svg(path)
+    if svg is None:
+        requests["external"].add(path)
+        return
+    page["inlined_svgs"] = page.get("inlined_svgs", 0) + 1
+    prefix = "svg{}-".format(page["inlined_svgs"])
+    try:
+        element = ElementTree.fromstring(svg_id_pattern.sub(lambda match: match.group(1) + prefix, svg).encode())
+        inline = _svg_element(page["soup"], element)
+    except (ElementTree.ParseError, ValueError):
+        requests["external"].add(path)
+        return
+    for attribute in ["class", "width", "height"]:
+        if tag.has_attr(attribute):
+            inline[attribute] = tag[attribute]
+    if tag.name == "img":
+        # style.css gives these the rules of the images
+        classes = inline.get('class', [])
+        if isinstance(classes, str):
+            classes = classes.split()
+        inline['class'] = classes + ["inlined"]
+    if tag.get('alt'):
+        inline['role'] = "img"
+        inline['aria-label'] = tag['alt']
+    elif tag.name == "img":
+        inline['aria-hidden'] = "true"
+    tag.replace_with(inline)
+    requests["inlined"].add(path)
+
+def page_requests(filename):
+    "number of image requests of the page, and how many were saved by inlining"
+    requests = image_requests.get(filename, {"external": set(), "inlined": set()})
+    return {"requests": len(requests["external"]), "saved": len(requests["inlined"] - requests["external"])}
+
+def write_inline_svgs_report(requests, top=10):
+    "image requests per page with and without inlining, printing the pages that save the most"
+    saved = sum(page["saved"] for page in requests.values())
+    total = sum(page["requests"] + page["saved"] for page in requests.values())
+    report = {"threshold_bytes": inline_svg_bytes, "requests": total, "saved": saved, "pages": requests}
+    os.makedirs(os.path.dirname(INLINE_SVGS_REPORT), exist_ok=True)
+    with open(INLINE_SVGS_REPORT, "w") as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    print(f"Inlining SVGs up to {inline_svg_bytes} bytes saves {saved} of {total} image requests")
+    for filename, page in sorted(requests.items(), key=lambda item: -item[1]["saved"])[:top]:
+        if page["saved"]:
+            print(f"  {filename:<45} {page['requests'] + page['saved']:5} -> {page['requests']:5} requests")
+
+## asset fingerprints
+# references to the static files in processed/ get the hash of the file as
+# query string (style.css?v=0123456789), so that they can be cached for good
+# and browsers still get a new version as soon as a file changes. The hashes are
+# kept between builds and only recomputed for files whose mtime or size changed.
+ASSET_HASHES_FILE = ".build-cache/asset-hashes.json"
+ASSET_MANIFEST_FILE = "processed/asset-manifest.json"
+FINGERPRINT_LENGTH = 10
+FINGERPRINTED_ATTRIBUTES = {"link": "href", "script": "src", "img": "src", "object": "data", "source": "srcset"}
+
+css_url_pattern = re.compile(r"""url\((['"]?)([^'")]+)\1\)""")
+asset_manifest = {}
+
+def fingerprint_css_urls(css):
+    return css_url_pattern.sub(lambda m: f"url({m[1]}{asset_manifest.get(m[2], m[2])}{m[1]})", css)
+
+def write_stylesheet(filename):
+    "copy a stylesheet into processed/ with fingerprinted url()s, leaving the copy alone if it would not change"
+    with open(filename, "r") as f:
+        css = fingerprint_css_urls(f.read())
+    target = "processed/" + filename
+    if os.path.isfile(target):
+        with open(target, "r") as f:
+            if f.read() == css:
+                return
+    with open(target, "w") as f:
+        f.write(css)
+
+def build_asset_manifest():
+    "hash the static files in processed/ and write the manifest of their fingerprinted URLs"
+    global asset_manifest
+    index = {}
+    if os.path.isfile(ASSET_HASHES_FILE):
+        with open(ASSET_HASHES_FILE, "r") as f:
+            index = json.load(f)
+    hashes = {}
+    def add_hashes(paths):
+        for path in paths:
+            st = os.stat("processed/" + path)
+            entry = index.get(path)
+            if entry is None or entry["mtime"] != st.st_mtime_ns or entry["size"] != st.st_size:
+                entry = {"mtime": st.st_mtime_ns, "size": st.st_size, "hash": file_hash("processed/" + path)}
+            hashes[path] = entry
+            asset_manifest[path] = path + "?v=" + entry["hash"][:FINGERPRINT_LENGTH]
+    asset_manifest = {}
+    paths = [filename for filename in ASSET_FILES if filename not in STYLESHEETS]
+    for target_directory in ASSET_DIRECTORIES.values():
+        for directory, _, filenames in os.walk(target_directory):
+            for filename in filenames:
+                if compressed_source(filename) is None:
+                    paths.append(os.path.relpath(os.path.join(directory, filename), "processed"))
+    add_hashes(paths)
+    # the stylesheets refer to images, so their fingerprints come last
+    for filename in STYLESHEETS:
+        write_stylesheet(filename)
+    add_hashes(STYLESHEETS)
+    with open(ASSET_HASHES_FILE, "w") as f:
+        json.dump(hashes, f, sort_keys=True)
+    manifest = json.dumps(asset_manifest, indent=1, sort_keys=True)
+    previous = None
+    if os.path.isfile(ASSET_MANIFEST_FILE):
+        with open(ASSET_MANIFEST_FILE, "r") as f:
+            previous = f.read()
+    # rewriting an unchanged manifest would make compress_processed_files compress it again
+    if manifest != previous:
+        with open(ASSET_MANIFEST_FILE, "w") as f:
+            f.write(manifest)
+
+## precompression
+# .br and .gz siblings of the text files in processed/, so that the web server
+# can send them without compressing on the fly. brotli is optional: without it,
+# only the .gz files are written.
+COMPRESSIBLE_EXTENSIONS = [".html", ".css", ".js", ".svg", ".json", ".xml", ".txt"]
+COMPRESSED_SUFFIXES = [".br", ".gz"]
+# size and mtime of every compressed file, so that its variants are only written
+# again when it changes: placed files keep the mtime of their cache entry, so an
+# older mtime does not mean that a variant is up to date
+COMPRESSION_INDEX_FILE = ".build-cache/compressed-files.json"
+
+def compressed_source(filename):
+    "the file that filename is a compressed variant of, or None"
+    base, suffix = os.path.splitext(filename)
+    if suffix in COMPRESSED_SUFFIXES and os.path.splitext(base)[1] in COMPRESSIBLE_EXTENSIONS:
+        return base
+    return None
+
+def compression_suffixes():
+    try:
+        import brotli
+    except ImportError:
+        return [".gz"]
+    return COMPRESSED_SUFFIXES
+
+def compress_file(task):
+    """write the compressed variants of path unless entry (from the index) shows that they are up to date,
+    returning the size that is served for each suffix, whether anything was compressed and the new index entry"""
+    path, entry = task
+    st = os.stat(path)
+    suffixes = compression_suffixes()
+    if entry and entry["mtime"] == st.st_mtime_ns and entry["size"] == st.st_size and entry["suffixes"] == suffixes \
+            and all(os.path.isfile(path + suffix) for suffix in entry["written"]):
+        sizes = {"": st.st_size}
+        for suffix in suffixes:
+            sizes[suffix] = os.path.getsize(path + suffix) if suffix in entry["written"] else st.st_size
+        return path, sizes, False, entry
+    with open(path, "rb") as f:
+        data = f.read()
+    sizes = {"": len(data)}
+    written = []
+    for suffix in suffixes:
+        if suffix == ".br":
+            import brotli
+            compressed = brotli.compress(data, quality=11)
+        else:
+            # mtime=0 makes the output reproducible
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(compressed) < len(data):
+            with open(path + suffix, "wb") as f:
+                f.write(compressed)
+            written.append(suffix)
+            sizes[suffix] = len(compressed)
+        else:
+            # not worth it, the web server sends the file itself
+            if os.path.isfile(path + suffix):
+                os.remove(path + suffix)
+            sizes[suffix] = len(data)
+    entry = {"mtime": st.st_mtime_ns, "size": st.st_size, "suffixes": suffixes, "written": written}
+    return path, sizes, True, entry
+
+def compress_processed_files(jobs=1):
+    "write .br/.gz siblings for every compressible file in processed/ and print the ratios per type"
+    if ".br" not in compression_suffixes():
+        print("brotli is not installed, only writing .gz files")
+    index = {}
+    if os.path.isfile(COMPRESSION_INDEX_FILE):
+        with open(COMPRESSION_INDEX_FILE, "r") as f:
+            index = json.load(f)
+    paths = []
+    for directory, _, filenames in os.walk("processed"):
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1] in COMPRESSIBLE_EXTENSIONS:
+                paths.append(os.path.join(directory, filename))
+    tasks = [(path, index.get(path)) for path in paths]
+    if jobs <= 1:
+        results = [compress_file(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(jobs) as pool:
+            results = pool.map(compress_file, tasks, chunksize=16)
+    totals = {}
+    compressed = 0
+    index = {}
+    for path, sizes, changed, entry in results:
+        compressed += changed
+        index[path] = entry
+        extension_totals = totals.setdefault(os.path.splitext(path)[1], {})
+        for suffix, size in sizes.items():
+            extension_totals[suffix] = extension_totals.get(suffix, 0) + size
+    os.makedirs(os.path.dirname(COMPRESSION_INDEX_FILE), exist_ok=True)
+    with open(COMPRESSION_INDEX_FILE, "w") as f:
+        json.dump(index, f, sort_keys=True)
+    print(f"Compressed {compressed} of {len(paths)} files")
+    for extension, sizes in sorted(totals.items()):
+        ratios = "   ".join(f"{suffix} {sizes[suffix] / max(sizes[''], 1):6.1%}" for suffix in compression_suffixes())
+        print(f"  {extension:<6} {sizes[''] / 1e6:8.2f} MB   {ratios}")
+
+## single-pass transforms
+# instead of one find_all over the whole page per transform, walk_page visits
+# every element once and calls the handlers registered for its tag name and/or
+# class. Handlers run in the order of this table, which is the order in which
+# the transforms used to run one after another. Handlers that look at the
+# neighbours of an element run after the walk, once all elements have been
+# visited, so that they see the same tree as before.
+# (tag name, class, handler, run after the walk)
+ELEMENT_HANDLERS = [
+    ("a", None, remove_html_from_links, False),
+    (None, "example-code", addClipboardButtons, False),
+    ("a", None, rewrite_svg_links, False),
+    ("div", "prefers-svg", mark_prefers_svg, False),
+    ("img", None, process_image, False),
+    ("object", None, add_object_dimensions, False),
+    ("img", None, inline_svg, False),
+    ("object", None, inline_svg, False),
+    (None, "example", make_example_figure, False),
+    (None, "example-code", make_example_code, False),
+    ("span", "texttt", texttt_span, True),
+    ("span", "verb", texttt_span, True),
+    (None, "numsp", remove_numsp_tag, True),
+    (None, "example-code", strip_code_links, True),
+    # last, so that the other handlers see the plain file names
+    ("link", None, fingerprint_asset, True),
+    ("script", None, fingerprint_asset, True),
+    ("img", None, fingerprint_asset, True),
+    ("object", None, fingerprint_asset, True),
+    ("source", None, fingerprint_asset, True),
+]
+
+def _index_element_handlers():
+    "positions of the handlers in ELEMENT_HANDLERS, by tag name and by class"
+    by_name = {}
+    by_class = {}
+    for index, (name, class_, handler, after_walk) in enumerate(ELEMENT_HANDLERS):
+        if class_ is None:
+            by_name.setdefault(name, []).append(index)
+        else:
+            by_class.setdefault(class_, []).append(index)
+    return by_name, by_class
+
+handlers_by_name, handlers_by_class = _index_element_handlers()
+# a find_all per distinct selector, which the single walk replaces
+ELEMENT_SELECTORS = len({(name, class_) for name, class_, _, _ in ELEMENT_HANDLERS})
+
+def _matching_handlers(tag):
+    indices = set(handlers_by_name.get(tag.name, ()))
+    classes = tag.get('class', [])
+    if isinstance(classes, str):
+        classes = classes.split()
+    for c in classes:
+        for index in handlers_by_class.get(c, ()):
+            name = ELEMENT_HANDLERS[index][0]
+            if name is None or name == tag.name:
+                indices.add(index)
+    return sorted(indices)
+
+def walk_page(filename, soup):
+    "apply all ELEMENT_HANDLERS in a single pass over the page, returns the number of elements visited"
+    page = {"filename": filename, "soup": soup}
+    image_requests[filename] = {"external": set(), "inlined": set()}
+    after_walk = []
+    visited = 0
+
+    def visit(tag):
+        nonlocal visited
+        visited += 1
+        for index in _matching_handlers(tag):
+            handler = ELEMENT_HANDLERS[index][2]
+            if ELEMENT_HANDLERS[index][3]:
+                after_walk.append((index, tag))
+                continue
+            replacement = handler(page, tag)
+            if replacement is not None:
+                # the handler replaced the element, continue with the new one
+                visit(replacement)
+                return
+            if tag.parent is None:
+                # the handler removed the element
+                return
+        for child in list(tag.contents):
+            if isinstance(child, Tag):
+                visit(child)
+
+    visit(soup)
+    # sorting is stable, so elements stay in document order for each handler
+    for index, tag in sorted(after_walk, key=lambda item: item[0]):
+        ELEMENT_HANDLERS[index][2](page, tag)
+    return visited
+
+def transform_page(filename, parser):
+    "parse a page with the given tree builder and apply all transforms to it"
+    with stage(filename, "parse"):
+        with open(filename, "r") as fp:
+            soup = BeautifulSoup(fp, parser)
+    run_stage(filename, add_footer, soup)
+    run_stage(filename, shorten_sidetoc_and_add_part_header, soup, is_home=(filename == "index-0.html"))
+    run_stage(filename, rearrange_heading_anchors, soup)
+    run_stage(filename, make_page_toc, soup)
+    run_stage(filename, remove_mathjax_if_possible, filename, soup)
+    run_stage(filename, make_entryheadline_anchor_links, soup)
+    run_stage(filename, remove_useless_elements, soup)
+    with stage(filename, "walk_page") as record:
+        record["elements"] = walk_page(filename, soup)
+    run_stage(filename, add_header, soup)
+    run_stage(filename, favicon, soup)
+    run_stage(filename, add_meta_tags, filename, soup)
+    run_stage(filename, add_copyright_comment_block, filename, soup)
+    soup.find(class_="bodyandsidetoc")['class'].append("grid-container")
+    if filename == "index-0.html":
+        soup.h4.decompose() # don't need header on start page
+        soup.body['class'] = "index-page"
+        run_stage(filename, add_version_date, soup)
+    return soup
+
+## parser backends
+# html5lib parses like a browser does, but it is the slowest tree builder;
+# the faster ones can be checked against it with --verify-parser
+PARSERS = ["html5lib", "lxml", "html.parser"]
+html_parser = "html5lib"
+
+def normalize_html(html):
+    "collapse whitespace and put every tag on its own line, for comparing pages"
+    html = re.sub(r"\s+", " ", html)
+    html = re.sub(r"> ?<", ">\n<", html)
+    return html.strip()
+
+def verify_file(filename):
+    "check that html_parser gives the same page as html5lib, returns whether it does"
+    print(f"Verifying {filename}")
+    reference = normalize_html(serialize_page(transform_page(filename, "html5lib")))
+    candidate = normalize_html(serialize_page(transform_page(filename, html_parser)))
+    if reference == candidate:
+        return True
+    print(f"MISMATCH: {filename} differs between html5lib and {html_parser}")
+    diff = difflib.unified_diff(reference.splitlines(), candidate.splitlines(),
+                                "html5lib", html_parser, n=1, lineterm="")
+    for line in itertools.islice(diff, 40):
+        print("    " + line)
+    return False
+
+def process_file(filename):
+    print(f"Processing {filename}")
+    if filename == profile_page:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    page_start = time.perf_counter()
+    first_record = len(page_timings)
+    soup = transform_page(filename, html_parser)
+    output = output_filename(filename)
+    run_stage(filename, write_to_file, soup, "processed/"+output, page_patches(output))
+    record_page(filename, page_start, first_record)
+    if filename == profile_page:
+        profiler.disable()
+        profile_filename = os.path.join(REPORTS_DIRECTORY, "profile-" + os.path.splitext(filename)[0] + ".prof")
+        os.makedirs(REPORTS_DIRECTORY, exist_ok=True)
+        profiler.dump_stats(profile_filename)
+        print(f"Wrote profile of {filename} to {profile_filename}")
+    return page_requests(filename)
+
+## PDF destinations
+# the page numbers of all sections of the PDF manual, used for the deep links.
+# Parsing the output of pdfinfo takes a while, so the table is cached under the
+# hash of the PDF. In offline mode, the PDF (and the commit date) are never downloaded.
+PDF_URL = "https://pgf-tikz.github.io/pgf/pgfmanual.pdf"
+DESTINATIONS_FILE = ".build-cache/pdf-destinations.json"
+offline = False
+# example line:
+# 1268 [ XYZ   64  102 null      ] "subsection.123.10"
+# should become
+# destinations["subsection.123.10"] = "1268"
+destination_pattern = re.compile(r'(\d+) \[ XYZ\s+\d+\s+\d+\s+null\s+\] "(.+?)"')
+
+def parse_destinations(output):
+    "parse the output of pdfinfo -dests"
+    table = {}
+    for line in output.split('\n'):
+        match = destination_pattern.search(line)
+        if match:
+            table[match.group(2)] = match.group(1)
+    return table
+
+def load_destinations_cache():
+    if os.path.isfile(DESTINATIONS_FILE):
+        with open(DESTINATIONS_FILE, "r") as f:
+            return json.load(f)
+    return {"pdf": None, "destinations": {}}
+
+def read_destinations(pdf_filename):
+    "the destination table of the PDF, downloading the PDF if needed (unless offline)"
+    cache = load_destinations_cache()
+    if not os.path.isfile(pdf_filename):
+        if offline:
+            if cache["pdf"] is None:
+                sys.exit(f"Offline, but neither {pdf_filename} nor {DESTINATIONS_FILE} exists")
+            print(f"Offline and {pdf_filename} does not exist, using cached PDF page numbers")
+            return cache["destinations"]
+        print("Downloading PDF")
+        import requests
+        response = requests.get(PDF_URL)
+        with open(pdf_filename, "wb") as file:
+            file.write(response.content)
+    pdf_hash = file_hash(pdf_filename)
+    if cache["pdf"] == pdf_hash:
+        print("Using cached PDF page numbers")
+        return cache["destinations"]
+    print("Getting PDF page numbers")
+    pdfinfo = subprocess.run(["pdfinfo", "-dests", pdf_filename], capture_output=True)
+    if pdfinfo.returncode != 0:
+        print("Error running pdfinfo:", pdfinfo.stderr.decode())
+        return {}
+    table = parse_destinations(pdfinfo.stdout.decode())
+    os.makedirs(os.path.dirname(DESTINATIONS_FILE), exist_ok=True)
+    with open(DESTINATIONS_FILE, "w") as f:
+        json.dump({"pdf": pdf_hash, "destinations": table}, f, indent=1, sort_keys=True)
+    return table
+
+def get_destinations():
+    "the PDF destination table, read (and if necessary downloaded) on first use"
+    global destinations
+    if destinations is None:
+        destinations = read_destinations("pgfmanual.pdf")
+    return destinations
+
+def get_meta_descriptions():
+    "the meta descriptions of the pages, by file stem, read on first use"
+    global meta_descriptions
+    if meta_descriptions is None:
+        with open("meta-descriptions.json", "r") as f:
+            meta_descriptions = json.load(f)
+    return meta_descriptions
+
+## instrumentation
+# with --timings, every stage of every page records its wall time, and with
+# --trace-memory also the peak memory it allocated on top of what was already
+# allocated when it started (measured with tracemalloc, which slows everything down)
+REPORTS_DIRECTORY = "build-reports"
+instrumentation_enabled = False
+trace_memory = False
+profile_page = None
+page_timings = []
+
+@contextlib.contextmanager
+def stage(filename, name):
+    "time the body, which may add further fields (such as counters) to the yielded record"
+    record = {"page": filename, "stage": name}
+    if not instrumentation_enabled:
+        yield record
+        return
+    if trace_memory:
+        allocated = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        if trace_memory:
+            record["peak_bytes"] = tracemalloc.get_traced_memory()[1] - allocated
+        page_timings.append(record)
+
+def run_stage(filename, transform, *args, **kwargs):
+    with stage(filename, transform.__name__):
+        return transform(*args, **kwargs)
+
+def record_page(filename, start, first_record):
+    "record a stage 'page' with the total time and the largest peak of the page's stages"
+    if not instrumentation_enabled:
+        return
+    record = {"page": filename, "stage": "page", "seconds": time.perf_counter() - start}
+    if trace_memory:
+        record["peak_bytes"] = max((record["peak_bytes"] for record in page_timings[first_record:]), default=0)
+    page_timings.append(record)
+
+def write_timings_report(top=10):
+    os.makedirs(REPORTS_DIRECTORY, exist_ok=True)
+    with open(os.path.join(REPORTS_DIRECTORY, "timings.json"), "w") as f:
+        json.dump(page_timings, f, indent=1)
+    with open(os.path.join(REPORTS_DIRECTORY, "timings.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["page", "stage", "seconds", "peak_bytes", "elements"])
+        writer.writeheader()
+        writer.writerows(page_timings)
+    pages = [record for record in page_timings if record["stage"] == "page"]
+    stages = {}
+    for record in page_timings:
+        if record["stage"] == "page":
+            continue
+        total = stages.setdefault(record["stage"], {"seconds": 0})
+        total["seconds"] += record["seconds"]
+        if "peak_bytes" in record:
+            total["peak_bytes"] = max(total.get("peak_bytes", 0), record["peak_bytes"])
+    def memory(record):
+        return f" {record['peak_bytes'] / 1e6:8.1f} MB" if "peak_bytes" in record else ""
+    print(f"Slowest pages (of {len(pages)}):")
+    for record in sorted(pages, key=lambda record: -record["seconds"])[:top]:
+        print(f"  {record['page']:<45} {record['seconds']:8.3f} s" + memory(record))
+    walks = [record for record in page_timings if record["stage"] == "walk_page"]
+    if walks:
+        print(f"Single-pass transforms visited {sum(record['elements'] for record in walks)} elements "
+              f"in one traversal per page instead of {ELEMENT_SELECTORS}")
+    print("Slowest stages (total over all pages):")
+    for name, total in sorted(stages.items(), key=lambda item: -item[1]["seconds"])[:top]:
+        print(f"  {name:<45} {total['seconds']:8.3f} s" + memory(total))
+
+## parallel processing
+def _init_worker(shared):
+    "give each worker process only the shared data that process_file needs"
+    globals().update(shared)
+    if trace_memory:
+        tracemalloc.start()
+
+def _run_in_worker(task, filename):
+    """run task(filename) in a worker, returning its result and its log output (so the
+    parent can print it in page order), together with the timings recorded for the page"""
+    log = io.StringIO()
+    page_timings.clear()
+    with contextlib.redirect_stdout(log):
+        result = task(filename)
+    return result, log.getvalue(), list(page_timings)
+
+def process_files(filenames, jobs=1, task=process_file):
+    "run task (process_file or verify_file) on every page, returning the results in order"
+    if jobs <= 1:
+        return [task(filename) for filename in filenames]
+    shared = {
+        "instrumentation_enabled": instrumentation_enabled,
+        "trace_memory": trace_memory,
+        "profile_page": profile_page,
+        "html_parser": html_parser,
+        "offline": offline,
+        "commit_date": commit_date,
+        "inline_svg_bytes": inline_svg_bytes,
+    }
+    if multiprocessing.get_start_method() != "fork":
+        # forked workers inherit the tables, others would have to read them again
+        shared.update({
+            "destinations": get_destinations(),
+            "meta_descriptions": get_meta_descriptions(),
+            "svg_dimensions": svg_dimensions,
+            "image_formats": image_formats,
+            "responsive_images": responsive_images,
+            "duplicate_images": duplicate_images,
+            "asset_manifest": asset_manifest,
+        })
+    results = []
+    timings = []
+    with multiprocessing.Pool(jobs, initializer=_init_worker, initargs=(shared,)) as pool:
+        # imap returns results in input order, so the log stays deterministic
+        for result, log, worker_timings in pool.imap(functools.partial(_run_in_worker, task), filenames):
+            print(log, end="")
+            results.append(result)
+            timings.extend(worker_timings)
+    page_timings.extend(timings)
+    return results
+
+def main():
+    global instrumentation_enabled, trace_memory, profile_page, html_parser, offline, commit_date, inline_svg_bytes
+    parser = argparse.ArgumentParser(description="Postprocess the lwarp HTML files into processed/")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of worker processes used to process pages (default: 1)")
+    parser.add_argument("--force", action="store_true",
+                        help="rebuild all pages, ignoring the build manifest")
+    parser.add_argument("--timings", action="store_true",
+                        help="record the time of every stage of every page in build-reports/")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="with --timings, also record the peak memory of every stage (slow)")
+    parser.add_argument("--profile", metavar="PAGE",
+                        help="write cProfile data for processing PAGE (e.g. tikz-shapes.html) to build-reports/")
+    parser.add_argument("--parser", choices=PARSERS, default="html5lib",
+                        help="tree builder used to parse the lwarp pages (default: html5lib)")
+    parser.add_argument("--verify-parser", action="store_true",
+                        help="instead of building, check for every page that --parser gives the same output as html5lib")
+    parser.add_argument("--sync-method", choices=SYNC_METHODS, default="copy",
+                        help="how changed static files are put into processed/ (default: copy)")
+    parser.add_argument("--sync-check", choices=SYNC_CHECKS, default="mtime",
+                        help="how unchanged static files are recognized: size and mtime, or size and content hash (default: mtime)")
+    parser.add_argument("--responsive-formats", nargs="+", choices=RESPONSIVE_FORMATS, default=[],
+                        help="also write the resized variants of the PNGs in these formats (needs Pillow)")
+    parser.add_argument("--inline-svgs", type=int, default=0, metavar="BYTES",
+                        help="put the SVGs from pgfmanual-images up to BYTES into the pages instead of linking them (default: 0, off)")
+    parser.add_argument("--no-compress", action="store_true",
+                        help="don't write .br and .gz variants of the files in processed/")
+    parser.add_argument("--offline", action="store_true",
+                        help="never access the network: use the local PDF or the cached PDF page numbers, and the cached commit date")
+    args = parser.parse_args()
+    html_parser = args.parser
+    offline = args.offline
+    inline_svg_bytes = args.inline_svgs
+    instrumentation_enabled = args.timings
+    trace_memory = args.timings and args.trace_memory
+    profile_page = args.profile
+    if trace_memory:
+        tracemalloc.start()
+
+    # look up the commit date for the home page in the background
+    commit_date_executor = ThreadPoolExecutor(max_workers=1)
+    commit_date_lookup = start_commit_date_lookup(commit_date_executor)
+
+    # mkdir processed
+    os.makedirs("processed", exist_ok=True)
+    find_duplicate_images()
+    sync_assets(args.sync_method, args.sync_check)
+    optimize_svgs(args.jobs, args.sync_method)
+
+    print("Reading SVG dimensions")
+    update_svg_dimensions(["processed/pgfmanual-images", "processed/standalone"])
+    build_image_format_table("pgfmanual-images")
+    write_image_format_report()
+    build_responsive_images(args.responsive_formats, args.jobs, args.sync_method)
+    build_asset_manifest()
+
+    # get the page numbers of all the sections (this will be used in the deep links)
+    get_destinations()
+    get_meta_descriptions()
+
+    commit_date = commit_date_lookup()
+    commit_date_executor.shutdown(wait=False)
+
+    filenames = []
+    for filename in sorted(os.listdir()):
+        if filename.endswith(".html"):
+            if filename in ["description.html", "pgfmanual_html.html", "home.html"] or "spotlight" in filename:
+                continue
+            filenames.append(filename)
+    write_deduplication_report(filenames)
+
+    if args.verify_parser:
+        results = process_files(filenames, jobs=args.jobs, task=verify_file)
+        mismatches = [filename for filename, same in zip(filenames, results) if not same]
+        print(f"{len(filenames) - len(mismatches)} of {len(filenames)} pages are identical with {html_parser} and html5lib")
+        for filename in mismatches:
+            print(f"  differs: {filename}")
+        sys.exit(1 if mismatches else 0)
+
+    # only rebuild pages whose inputs changed since the last run
+    manifest = load_manifest()
+    inputs = {filename: page_inputs(filename) for filename in filenames}
+    changed_filenames = []
+    for filename in filenames:
+        if args.force \
+                or manifest["pages"].get(filename) != inputs[filename] \
+                or not os.path.isfile("processed/" + output_filename(filename)):
+            changed_filenames.append(filename)
+    if len(changed_filenames) < len(filenames):
+        print(f"Skipping {len(filenames) - len(changed_filenames)} unchanged pages")
+    results = process_files(changed_filenames, jobs=args.jobs)
+
+    unformatted = []
+    if changed_filenames:
+        print("Prettifying")
+        unformatted = format_pages(["processed/" + output_filename(filename) for filename in changed_filenames], jobs=args.jobs)
+
+    for filename in changed_filenames:
+        if filename == "index-0.html":
+            continue
+        run_stage(filename, numspace_to_spaces, filename)
+
+    # pages that prettier failed on are left out, so that the next run builds them again
+    manifest["pages"] = {filename: inputs[filename] for filename in filenames
+                         if "processed/" + output_filename(filename) not in unformatted}
+    # the request counts of the skipped pages are the ones of their last build
+    requests = manifest.get("image-requests", {})
+    requests.update(zip(changed_filenames, results))
+    manifest["image-requests"] = {filename: requests[filename] for filename in filenames if filename in requests}
+    save_manifest(manifest)
+    save_file_hashes()
+    if inline_svg_bytes:
+        write_inline_svgs_report(manifest["image-requests"])
+
+    if not args.no_compress:
+        print("Compressing")
+        compress_processed_files(jobs=args.jobs)
+
+    if instrumentation_enabled:
+        write_timings_report()
+
+    print("Finished")
 
-print("Finished")
\ No newline at end of file
+if __name__ == "__main__":
+    main()